@@ -0,0 +1,84 @@
+# benchmarks/bench_memory.py
+#
+# Memory per user record: plain dicts (as json.load and the streaming loader
+# produce them) against UserRecord. Records come from the same synthetic
+# generator as bench_storage.py.
+#
+#   python benchmarks/bench_memory.py [--users N]
+#
+# Sizes are measured with tracemalloc, so they cover the records themselves
+# (dicts, slots, strings, numbers) but not interpreter overhead.
+
+import os
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_storage import make_user
+
+def write_users(path, size, seed=42):
+    rng = random.Random(seed)
+    today = datetime.now(timezone.utc).date()
+    users = {str(1_000_000_000 + i): make_user(rng, 1_000_000_000 + i, size, today) for i in range(size)}
+    with open(path, "w") as f:
+        json.dump(users, f, indent=4)
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    users = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return users, after - before
+
+def time_copies(users, copier, rounds=3):
+    sample = list(users.values())[:20_000]
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for info in sample:
+            copier(info)
+        best = min(best, time.perf_counter() - start)
+    return best / len(sample)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory use of user record layouts")
+    parser.add_argument("--users", type=int, default=200_000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_memory_"), "user_data.json")
+    write_users(path, args.users)
+
+    def load_dicts():
+        with open(path) as f:
+            return json.load(f)
+
+    layouts = [
+        ("dict (json.load)", load_dicts, copy.deepcopy),
+        ("dict (streamed)", lambda: {key: info for key, info, _ in bot.iter_data(path)}, copy.deepcopy),
+        ("UserRecord", lambda: {key: bot.UserRecord(info) for key, info, _ in bot.iter_data(path)}, bot.UserRecord.copy),
+    ]
+
+    print(f"{args.users:,} users, user_data.json {os.path.getsize(path) / 1e6:,.1f} MB\n")
+    print(f"{'layout':18} {'total':>10} {'per user':>10} {'copy':>10}")
+    baseline = None
+    for name, build, copier in layouts:
+        users, size = measure(build)
+        per_copy = time_copies(users, copier)
+        baseline = baseline or size
+        print(f"{name:18} {size / 1e6:>8,.1f}MB {size / args.users:>8,.0f} B {per_copy * 1e6:>8,.2f}us"
+              f"  ({size / baseline:.0%} of json.load)")
+        del users
+
+if __name__ == "__main__":
+    main()
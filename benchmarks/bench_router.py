@@ -0,0 +1,89 @@
+# benchmarks/bench_router.py
+#
+# Micro-benchmark of handle_text_message routing: the dict-based router
+# (resolve_route) against the old lowercase + if/elif chain.
+#
+#   python benchmarks/bench_router.py [--iterations N]
+
+import os
+import sys
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from bot import ChatState, resolve_route
+
+BUTTONS = [
+    "💰 Balance", "📝 Tasks", "🏦 Set Account", "👥 Referral", "💳 Withdraw",
+    "📋 Withdrawals", "🏆 Level", "🎁 Daily Bonus", "🏠 Main Menu",
+]
+FREE_TEXT = ["opay", "0123456789", "John Doe", "1500", "hello"]
+STATES = list(ChatState)
+
+def legacy_route(text, user_data):
+    """The routing done by handle_text_message before the dispatch table."""
+    text = text.lower()
+    if text == "💰 balance":
+        return bot.balance
+    elif text == "📝 tasks":
+        return bot.tasks
+    elif text == "🏦 set account":
+        return bot.set_account
+    elif text == "👥 referral":
+        return bot.referral
+    elif text == "💳 withdraw":
+        return bot.withdraw
+    elif text == "📋 withdrawals":
+        return bot.withdrawals
+    elif text == "🏆 level":
+        return bot.level
+    elif text == "🎁 daily bonus":
+        return bot.daily_bonus
+    elif text == "🏠 main menu":
+        return bot.main_menu
+    else:
+        if user_data.get("awaiting_bank"):
+            return bot.handle_bank_selection
+        elif user_data.get("awaiting_account_number"):
+            return bot.handle_account_number
+        elif user_data.get("awaiting_account_name"):
+            return bot.handle_account_name
+        elif user_data.get("awaiting_withdrawal_amount"):
+            return bot.handle_withdrawal_amount
+        else:
+            return bot.unknown_command
+
+def make_workload(size, seed=1):
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(size):
+        state = rng.choice(STATES)
+        text = rng.choice(BUTTONS) if rng.random() < 0.7 else rng.choice(FREE_TEXT)
+        workload.append((text, state, {state.value: True}))
+    return workload
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark handle_text_message routing")
+    parser.add_argument("--iterations", type=int, default=20, help="passes over the workload")
+    parser.add_argument("--size", type=int, default=100_000, help="messages per pass")
+    args = parser.parse_args()
+
+    workload = make_workload(args.size)
+
+    def run_router():
+        for text, state, _ in workload:
+            resolve_route(text, state)
+
+    def run_legacy():
+        for text, _, flags in workload:
+            legacy_route(text, flags)
+
+    for name, fn in (("if/elif chain", run_legacy), ("dispatch table", run_router)):
+        best = min(timeit.repeat(fn, number=1, repeat=args.iterations))
+        print(f"{name:15} {args.size / best:>14,.0f} routes/s  ({best / args.size * 1e9:,.0f} ns/route)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# benchmarks/bench_storage.py
+#
+# Storage and handler latency as the user base grows. For each store size a
+# synthetic user_data.json / withdrawal log is generated in a temp directory
+# and a fresh interpreter times the storage functions and the main handlers
+# (driven with fake Update/Context objects, no network needed).
+#
+#   python benchmarks/bench_storage.py                      # 1k, 10k, 100k users
+#   python benchmarks/bench_storage.py --sizes 1000000 --backend sqlite
+#
+# Reports p50/p99 latency and bytes written per operation (from
+# /proc/self/io, so Linux only; shown as "-" elsewhere). Run it before and
+# after a storage change and compare.
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_NAMES = ["Ada", "Chidi", "Emeka", "Funmi", "Ngozi", "Tunde", "Zainab", "Ifeanyi", "Kemi", "Segun"]
+LAST_NAMES = ["Okafor", "Adeyemi", "Bello", "Eze", "Ogunleye", "Nwosu", "Balogun", "Musa"]
+
+# --- Synthetic data ---
+def make_user(rng, user_id, size, today):
+    user = {
+        "verified_user": rng.random() < 0.8,
+        "completed_initial_tasks": True,
+        "points": rng.randint(0, 5000),
+        "total_earned": rng.randint(0, 12000),
+        "referrals": int(rng.paretovariate(1.5)) - 1,
+    }
+    if rng.random() < 0.6:
+        user["referral"] = str(rng.randint(1, size))
+    if rng.random() < 0.5:
+        user["account_set"] = True
+        user["bank_name"] = rng.choice(["Opay", "Palmpay"])
+        user["account_number"] = "".join(rng.choice("0123456789") for _ in range(10))
+        user["account_name"] = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    for field in ("daily_bonus", "daily_tasks"):
+        if rng.random() < 0.7:
+            user[field] = {"date": (today - timedelta(days=rng.randint(0, 30))).isoformat()}
+    if rng.random() < 0.2:
+        user["total_withdrawn"] = rng.randint(1, 5) * 1000
+    return user
+
+def generate(size, seed=42):
+    """Write user_data.json and withdrawals.jsonl for ``size`` users into the cwd."""
+    rng = random.Random(seed)
+    today = datetime.now(timezone.utc).date()
+    users = {str(1_000_000_000 + i): make_user(rng, 1_000_000_000 + i, size, today) for i in range(size)}
+    with open("user_data.json", "w") as f:
+        json.dump(users, f, indent=4)
+
+    start = datetime(2024, 1, 1)
+    with open("withdrawals.jsonl", "w") as f:
+        for i in range(size // 5):
+            user_id = str(1_000_000_000 + rng.randrange(size))
+            record = {
+                "user_id": user_id,
+                "amount": float(rng.randint(1, 5) * 1000),
+                "status": rng.choice(["pending", "paid", "paid", "paid"]),
+                "date": (start + timedelta(minutes=i)).isoformat(),
+                "account_details": {"bank": "Opay", "account_number": "0123456789", "account_name": "Ada Eze"},
+            }
+            f.write(json.dumps({"id": f"{1_700_000_000 + i}.{i:06d}", "record": record}) + "\n")
+    return list(users)
+
+# --- Fakes ---
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = int(user_id)
+        self.username = f"user{user_id}"
+        self.first_name = "Bench"
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.photo = []
+
+    async def reply_text(self, text, **kwargs):
+        return None
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+class FakeUpdate:
+    def __init__(self, user_id, text=""):
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = FakeChat(int(user_id))
+        self.message = FakeMessage(text)
+        self.callback_query = None
+
+class FakeBot:
+    async def send_message(self, *args, **kwargs):
+        return None
+
+class FakeApplication:
+    def create_task(self, coroutine):
+        return asyncio.ensure_future(coroutine)
+
+class FakeContext:
+    def __init__(self, args=None):
+        self.user_data = {}
+        self.args = args or []
+        self.bot = FakeBot()
+        self.application = FakeApplication()
+
+# --- Measurement ---
+def bytes_written():
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def measure(name, ops, op):
+    """Time ``op(i)`` (sync or async) for i in range(ops)."""
+    samples = []
+    before = bytes_written()
+    for i in range(ops):
+        start = time.perf_counter()
+        result = op(i)
+        if asyncio.iscoroutine(result):
+            await result
+        samples.append(time.perf_counter() - start)
+    after = bytes_written()
+    written = (after - before) / ops if before is not None and after is not None else None
+    return {
+        "case": name,
+        "ops": ops,
+        "p50_us": percentile(samples, 0.50) * 1e6,
+        "p99_us": percentile(samples, 0.99) * 1e6,
+        "bytes_per_op": written,
+    }
+
+async def run_cases(bot, user_ids, ops, flush_ops):
+    rng = random.Random(7)
+    picks = [rng.choice(user_ids) for _ in range(ops)]
+    withdrawers = [
+        user_id for user_id, user_info in ((user_id, bot.get_user(user_id)) for user_id in user_ids[:50_000])
+        if user_info.get("account_set") and user_info.get("points", 0) >= 1000
+    ] or user_ids[:1]
+    results = []
+
+    async def flush_one(i):
+        user_info = bot.get_user(picks[i])
+        user_info["points"] = user_info.get("points", 0) + 1
+        bot.update_user(picks[i], user_info)
+        await bot.user_store.flush()
+
+    def update_one(i):
+        user_info = bot.get_user(picks[i])
+        user_info["points"] = user_info.get("points", 0) + 1
+        bot.update_user(picks[i], user_info)
+
+    def add_one(i):
+        bot.add_withdrawal(f"bench.{i}", {
+            "user_id": picks[i], "amount": 1000.0, "status": "pending",
+            "date": datetime.utcnow().isoformat(), "account_details": {},
+        })
+
+    def handler_case(handler, text="", state=None):
+        async def op(i):
+            context = FakeContext()
+            if state is not None:
+                context.user_data["state"] = state
+            await handler(FakeUpdate(picks[i], text), context)
+        return op
+
+    async def withdraw_op(i):
+        context = FakeContext()
+        context.user_data["state"] = bot.ChatState.AWAITING_WITHDRAWAL_AMOUNT
+        await bot.handle_withdrawal_amount(FakeUpdate(withdrawers[i % len(withdrawers)], "1000"), context)
+
+    async def start_op(i):
+        new_user = str(2_000_000_000 + i)
+        await bot.start(FakeUpdate(new_user, "/start"), FakeContext(args=[picks[i]]))
+
+    results.append(await measure("get_user", ops, lambda i: bot.get_user(picks[i])))
+    results.append(await measure("update_user", ops, update_one))
+    results.append(await measure("update_user+flush", flush_ops, flush_one))
+    results.append(await measure("get_user_withdrawals", ops, lambda i: bot.get_user_withdrawals(picks[i])))
+    results.append(await measure("add_withdrawal", ops, add_one))
+    results.append(await measure("load_withdrawals", max(1, flush_ops // 4), lambda i: bot.load_withdrawals()))
+    results.append(await measure("handler:balance", ops, handler_case(bot.balance)))
+    results.append(await measure("handler:level", ops, handler_case(bot.level)))
+    results.append(await measure("handler:withdrawals", ops, handler_case(bot.withdrawals)))
+    results.append(await measure("handler:daily_bonus", ops, handler_case(bot.daily_bonus)))
+    results.append(await measure("handler:text_router", ops, handler_case(bot.handle_text_message, "💰 Balance")))
+    results.append(await measure("handler:withdrawal_amount", min(ops, len(withdrawers)), withdraw_op))
+    results.append(await measure("handler:start+referral", ops, start_op))
+    await bot.user_store.flush()
+    return results
+
+def run_child(size, backend, ops, flush_ops):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{size}_")
+    os.chdir(workdir)
+    user_ids = generate(size)
+
+    os.environ["STORAGE_BACKEND"] = backend
+    os.environ["FLUSH_INTERVAL"] = "3600"  # flushes are timed explicitly
+    sys.path.insert(0, REPO_DIR)
+    import logging
+    logging.disable(logging.INFO)
+    import bot
+
+    if backend == "sqlite":
+        bot.import_json_to_sqlite()
+
+    async def go():
+        start = time.perf_counter()
+        bot.storage.open()
+        bot.user_store.load()
+        await bot.user_store.wait_loaded()
+        await bot.build_indexes()
+        startup = {"case": "startup(load+index)", "ops": 1, "p50_us": (time.perf_counter() - start) * 1e6,
+                   "p99_us": (time.perf_counter() - start) * 1e6, "bytes_per_op": 0}
+        return [startup] + await run_cases(bot, user_ids, ops, flush_ops)
+
+    results = asyncio.run(go())
+    file_size = os.path.getsize("user_data.json")
+    print(json.dumps({"size": size, "file_size": file_size, "results": results}))
+
+def fmt_bytes(value):
+    if value is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024:
+            return f"{value:,.0f} {unit}"
+        value /= 1024
+    return f"{value:,.0f} TB"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark storage functions and handlers by user count")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--ops", type=int, default=1000, help="operations per in-memory case")
+    parser.add_argument("--flush-ops", type=int, default=20, help="operations per case that writes to disk")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.backend, args.ops, args.flush_ops)
+        return
+
+    for size in args.sizes:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", str(size), "--backend", args.backend,
+               "--ops", str(args.ops), "--flush-ops", str(args.flush_ops)]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        print(f"\n{size:,} users ({args.backend}, user_data.json {fmt_bytes(report['file_size'])})")
+        print(f"{'case':28} {'ops':>6} {'p50':>12} {'p99':>12} {'written/op':>12}")
+        for row in report["results"]:
+            print(f"{row['case']:28} {row['ops']:>6} {row['p50_us']:>10,.1f}us {row['p99_us']:>10,.1f}us "
+                  f"{fmt_bytes(row['bytes_per_op']):>12}")
+
+if __name__ == "__main__":
+    main()
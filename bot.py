@@ -1,696 +1,3834 @@
-# bot.py
-
-import os
-import json
-import logging
-from datetime import datetime
-import urllib.parse
-from telegram.constants import ParseMode
-from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import (
-    ApplicationBuilder, CommandHandler, ConversationHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-)
-
-load_dotenv()
-
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
-TWITTER_HANDLE = os.getenv("TWITTER_HANDLE")
-BOT_USERNAME = "UtilizersBot"
-ADMIN_CHAT_ID = os.getenv("ADMIN_ID")  # Add this to your .env file
-
-# Conversion rate (points to Naira)
-POINTS_TO_NAIRA = 1  # 1 point = 1 Naira
-DAILY_BONUS_AMOUNT = 25  # 25 Naira daily bonus
-
-# Logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
-
-DATA_FILE = "user_data.json"
-WITHDRAWAL_FILE = "withdrawals.json"
-
-# --- Utility Functions ---
-def load_data():
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r") as f:
-                return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading data: {e}")
-    return {}
-
-def save_data(data):
-    try:
-        with open(DATA_FILE, "w") as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        logger.error(f"Error saving data: {e}")
-
-def load_withdrawals():
-    try:
-        if os.path.exists(WITHDRAWAL_FILE):
-            with open(WITHDRAWAL_FILE, "r") as f:
-                return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading withdrawals: {e}")
-    return {}
-
-def save_withdrawals(data):
-    try:
-        with open(WITHDRAWAL_FILE, "w") as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        logger.error(f"Error saving withdrawals: {e}")
-
-def get_user(user_id):
-    data = load_data()
-    return data.get(str(user_id), {})
-
-def update_user(user_id, user_info):
-    data = load_data()
-    data[str(user_id)] = user_info
-    save_data(data)
-
-def has_claimed_today(user_info, field):
-    today = datetime.utcnow().date().isoformat()
-    return user_info.get(field, {}).get("date") == today
-
-def mark_claimed_today(user_info, field):
-    today = datetime.utcnow().date().isoformat()
-    if field not in user_info:
-        user_info[field] = {}
-    user_info[field]["date"] = today
-
-def calculate_level(user_data):
-    referrals = user_data.get("referrals", 0)
-    total_earned = user_data.get("total_earned", 0)
-    
-    if referrals >= 100 and total_earned >= 10000:
-        return ("Guru", 5)
-    elif referrals >= 75 and total_earned >= 7500:
-        return ("Master", 4)
-    elif referrals >= 50 and total_earned >= 5000:
-        return ("Pro", 3)
-    elif referrals >= 20 and total_earned >= 2500:
-        return ("Amateur", 2)
-    else:
-        return ("Novice", 1)
-
-def get_main_menu_keyboard():
-    return ReplyKeyboardMarkup(
-        [
-            ["💰 Balance", "📝 Tasks"],
-            ["🏦 Set Account", "👥 Referral"],
-            ["💳 Withdraw", "📋 Withdrawals"],
-            ["🏆 Level", "🎁 Daily Bonus"],
-            ["🏠 Main Menu"]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False
-    )
-
-# --- Start Command ---
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    user_data = get_user(user.id)
-
-    if "referral" not in user_data:
-        if context.args:
-            referrer_id = context.args[0]
-            if referrer_id != str(user.id):
-                referrer_data = get_user(referrer_id)
-                referrer_data["points"] = referrer_data.get("points", 0) + 70
-                referrer_data["total_earned"] = user_data.get("total_earned", 0) + 70
-                referrer_data["referrals"] = referrer_data.get("referrals", 0) + 1
-                update_user(referrer_id, referrer_data)
-                user_data["referral"] = referrer_id
-                await update.message.reply_text(
-                    "🎯 You just referred a user and got 25 Points...",
-                    reply_markup=get_main_menu_keyboard()
-                )
-
-    update_user(user.id, user_data)
-
-    keyboard = [
-        [InlineKeyboardButton("🐦 Follow Twitter", url=f"https://twitter.com/{TWITTER_HANDLE}")],
-        [InlineKeyboardButton("💬 Join Whatsapp Group", url="https://chat.whatsapp.com/KyBPEZKLjAZ8JMgFt9KMft")],
-        [InlineKeyboardButton("📢 Join Whatsapp Channel", url="https://whatsapp.com/channel/0029VbAXEgUFy72Ich07Z53o")],
-	[InlineKeyboardButton("💬 Wanna Stream And Earn ?", url="https://chat.whatsapp.com/JdhB8efTVAOGZzFKoS9S4d")],
-        [InlineKeyboardButton("✅ Join Telegram Channel", url=f"https://t.me/{CHANNEL_USERNAME.lstrip('@')}")],
-        [InlineKeyboardButton("🔍 Verify Tasks", callback_data="verify_tasks")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        f"🎯 WELCOME {user.username or user.first_name} \n\nTo participate in the campaign, complete the tasks below:\n\n\n"
-        "Click the Verify Tasks button below to verify!",
-        reply_markup=reply_markup
-    )
-
-async def verify_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-
-    try:
-        member = await context.bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
-        if member.status not in ["member", "administrator", "creator"]:
-            raise Exception("Not joined")
-    except Exception as e:
-        logger.error(f"Error verifying channel membership: {e}")
-        await query.edit_message_text("❌ You have not joined the Telegram channel.\n\nType or tap /start to start again")
-        return
-
-    keyboard = [[InlineKeyboardButton("✅ I've Followed on Twitter", callback_data="confirm_twitter")]]
-    await query.edit_message_text(
-        "👀 We can't verify Twitter follows automatically.\n\n"
-        "Click the button below after you've followed us.",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
-
-async def confirm_twitter(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    user_data = get_user(user_id)
-    
-    # Mark tasks as completed
-    user_data["completed_initial_tasks"] = True
-    user_data["verified_user"] = True
-    user_data["points"] = user_data.get("points", 0) + 50  # 50 Naira for completing tasks
-    user_data["total_earned"] = user_data.get("total_earned", 0) + 50
-    
-    update_user(user_id, user_data)
-
-    await query.edit_message_text(
-        "✅ You're verified and have earned ₦50 for completing the tasks!\n\n"
-        "Use the menu below to explore the bot features:",
-        reply_markup=get_main_menu_keyboard()
-    )
-
-# --- Command Handlers ---
-async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.lower()
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    if not user_data.get("verified_user"):
-        await update.message.reply_text("❌ Please complete verification first using /start")
-        return
-    
-    if text == "💰 balance":
-        await balance(update, context)
-    elif text == "📝 tasks":
-        await tasks(update, context)
-    elif text == "🏦 set account":
-        await set_account(update, context)
-    elif text == "👥 referral":
-        await referral(update, context)
-    elif text == "💳 withdraw":
-        await withdraw(update, context)
-    elif text == "📋 withdrawals":
-        await withdrawals(update, context)
-    elif text == "🏆 level":
-        await level(update, context)
-    elif text == "🎁 daily bonus":
-        await daily_bonus(update, context)
-    elif text == "🏠 main menu":
-        await update.message.reply_text(
-            "Main Menu:",
-            reply_markup=get_main_menu_keyboard()
-        )
-    else:
-        # Handle context-specific inputs
-        if context.user_data.get("awaiting_bank"):
-            await handle_bank_selection(update, context)
-        elif context.user_data.get("awaiting_account_number"):
-            await handle_account_number(update, context)
-        elif context.user_data.get("awaiting_account_name"):
-            await handle_account_name(update, context)
-        elif context.user_data.get("awaiting_withdrawal_amount"):
-            await handle_withdrawal_amount(update, context)
-        else:
-            await update.message.reply_text(
-                "I didn't understand that command. Please use the menu buttons.",
-                reply_markup=get_main_menu_keyboard()
-            )
-
-async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    balance_naira = user_data.get("points", 0) * POINTS_TO_NAIRA
-    await update.message.reply_text(
-        f"💰 Your current balance: ₦{balance_naira:,.2f}",
-        reply_markup=get_main_menu_keyboard()
-    )
-
-#tasks
-async def tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    # Check if user has already claimed today
-    if has_claimed_today(user_data, "daily_tasks"):
-        await update.message.reply_text(
-            "❌ You've already completed tasks today. Come back tomorrow!",
-            reply_markup=get_main_menu_keyboard()
-        )
-        return
-    
-    bot_link = "https://t.me/UtilizersBot"
-    task_link1 = f"https://twitter.com/{TWITTER_HANDLE}"
-    post_text = f"I just joined the Utilizers, and you should too! \n\nGet started early and don't miss out. \n\nAct fast, and accumulate earnings!\n\n{bot_link}"
-    encoded_text = urllib.parse.quote(post_text)
-    task_link2 = f"https://twitter.com/intent/tweet?text={encoded_text}"
-    task_link3 = f"https://wa.me/?text={encoded_text}"
-    task_link4 = "https://chat.whatsapp.com/JdhB8efTVAOGZzFKoS9S4d"
-
-    message = (
-        f"📝 Available Tasks (Complete all to earn ₦50 daily):\n\n"
-        f"1. Follow <a href='{task_link1}'>Utilizer01 on Twitter</a>\n\n"
-        f"2. <a href='{task_link2}'>Post on X (Twitter)</a>\n\n"
-        f"3. <a href='{task_link3}'>Share to 5 WhatsApp groups and your status</a>\n\n"
-        f"4. <a href='{task_link4}'>Wanna stream your fav music and earn ? Join here</a>\n\n"
-        "After completing all tasks, upload screenshots as proof to claim your ₦50 reward."
-    )
-    
-    await update.message.reply_text(
-        message, 
-        parse_mode=ParseMode.HTML,
-        reply_markup=get_main_menu_keyboard()
-    )
-    context.user_data["awaiting_task_proof"] = True
-
-async def handle_task_proof(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get("awaiting_task_proof"):
-        return
-    
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    # Check if user has already claimed today
-    if has_claimed_today(user_data, "daily_tasks"):
-        await update.message.reply_text(
-            "❌ You've already claimed your daily task reward today. Come back tomorrow!",
-            reply_markup=get_main_menu_keyboard()
-        )
-        context.user_data["awaiting_task_proof"] = False
-        return
-    
-    # Award the user
-    user_data["points"] = user_data.get("points", 0) + 50
-    user_data["total_earned"] = user_data.get("total_earned", 0) + 50
-    mark_claimed_today(user_data, "daily_tasks")
-    update_user(user_id, user_data)
-    
-    await update.message.reply_text(
-        "✅ Screenshot received! You've been awarded ₦50 for completing today's tasks.",
-        reply_markup=get_main_menu_keyboard()
-    )
-    context.user_data["awaiting_task_proof"] = False
-
-
-async def receive_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user = get_user(user_id)
-    if not user["tasks_done"]:
-        user["tasks_done"] = True
-        user["balance"] += 50
-        update_user(user_id, user)
-        await update.message.reply_text("✅ Screenshot received. ₦50 added to your balance.")
-    else:
-        await update.message.reply_text("You've already submitted your tasks.")
-    return ConversationHandler.END
-
-
-async def set_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    # Check if user already has account details
-    if user_data.get("account_set"):
-        await update.message.reply_text(
-            f"Your current account details:\n"
-            f"Bank: {user_data.get('bank_name', 'Not set')}\n"
-            f"Account Number: {user_data.get('account_number', 'Not set')}\n"
-            f"Account Name: {user_data.get('account_name', 'Not set')}\n\n"
-            "To update, please send:\n"
-            "1. Your bank (OPay or PalmPay)\n"
-            "2. Your account number\n"
-            "3. Your account name\n\n"
-            "In separate messages.",
-            reply_markup=ReplyKeyboardMarkup(
-                [["🏠 Main Menu"]],
-                resize_keyboard=True
-            )
-        )
-        context.user_data["awaiting_bank"] = True
-        return
-    
-    await update.message.reply_text(
-        "Please set your account details by sending:\n"
-        "Your bank (OPay or PalmPay)\n",
-        reply_markup=ReplyKeyboardMarkup(
-            [["🏠 Main Menu"]],
-            resize_keyboard=True
-        )
-    )
-    context.user_data["awaiting_bank"] = True
-
-async def handle_bank_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    bank = update.message.text.strip().lower()
-    
-    if bank not in ["opay", "palmpay"]:
-        await update.message.reply_text(
-            "❌ Invalid bank. Please choose either OPay or PalmPay.",
-            reply_markup=ReplyKeyboardMarkup(
-                [["🏠 Main Menu"]],
-                resize_keyboard=True
-            )
-        )
-        return
-    
-    context.user_data["selected_bank"] = bank.capitalize()
-    context.user_data["awaiting_bank"] = False
-    context.user_data["awaiting_account_number"] = True
-    
-    await update.message.reply_text(
-        "Now please send your account number:",
-        reply_markup=ReplyKeyboardMarkup(
-            [["🏠 Main Menu"]],
-            resize_keyboard=True
-        )
-    )
-
-async def handle_account_number(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    account_number = update.message.text.strip()
-    
-    if not account_number.isdigit() or len(account_number) < 10:
-        await update.message.reply_text(
-            "❌ Invalid account number. Please enter a valid 10-digit account number.",
-            reply_markup=ReplyKeyboardMarkup(
-                [["🏠 Main Menu"]],
-                resize_keyboard=True
-            )
-        )
-        return
-    
-    context.user_data["account_number"] = account_number
-    context.user_data["awaiting_account_number"] = False
-    context.user_data["awaiting_account_name"] = True
-    
-    await update.message.reply_text(
-        "Now please send your account name as it appears on your bank records:",
-        reply_markup=ReplyKeyboardMarkup(
-            [["🏠 Main Menu"]],
-            resize_keyboard=True
-        )
-    )
-
-async def handle_account_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    account_name = update.message.text.strip()
-    
-    if len(account_name) < 2:
-        await update.message.reply_text(
-            "❌ Invalid account name. Please enter your full name.",
-            reply_markup=get_main_menu_keyboard()
-        )
-        return
-    
-    # Save all account details
-    user_data = get_user(user_id)
-    user_data["bank_name"] = context.user_data["selected_bank"]
-    user_data["account_number"] = context.user_data["account_number"]
-    user_data["account_name"] = account_name
-    user_data["account_set"] = True
-    update_user(user_id, user_data)
-    
-    # Clear context
-    context.user_data.clear()
-    
-    await update.message.reply_text(
-        f"✅ Account details saved successfully!\n\n"
-        f"Bank: {user_data['bank_name']}\n"
-        f"Account Number: {user_data['account_number']}\n"
-        f"Account Name: {user_data['account_name']}",
-        reply_markup=get_main_menu_keyboard()
-    )
-
-async def referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    ref_link = f"https://t.me/{BOT_USERNAME}?start={user_id}"
-    count = user_data.get("referrals", 0)
-    await update.message.reply_text(
-        f"👥 Your referral link:\n{ref_link}\n\n"
-        f"Total referrals: {count}\n"
-        f"Earn ₦70 for each successful referral (when they complete initial tasks)",
-        reply_markup=get_main_menu_keyboard()
-    )
-
-async def withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    if not user_data.get("account_set"):
-        await update.message.reply_text(
-            "❌ Please set your account details first using '🏦 Set Account'",
-            reply_markup=get_main_menu_keyboard()
-        )
-        return
-    
-    balance_naira = user_data.get("points", 0) * POINTS_TO_NAIRA
-    
-    if balance_naira < 1000:
-        await update.message.reply_text(
-            f"❌ Minimum withdrawal is ₦1,000. Your current balance is ₦{balance_naira:,.2f}",
-            reply_markup=get_main_menu_keyboard()
-        )
-        return
-    
-    await update.message.reply_text(
-        f"💰 Your current balance: ₦{balance_naira:,.2f}\n"
-        f"Minimum withdrawal: ₦1,000\n\n"
-        "Please enter the amount you want to withdraw:",
-        reply_markup=ReplyKeyboardMarkup(
-            [["🏠 Main Menu"]],
-            resize_keyboard=True
-        )
-    )
-    context.user_data["awaiting_withdrawal_amount"] = True
-
-async def handle_withdrawal_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    amount_text = update.message.text.strip()
-    
-    try:
-        amount = float(amount_text)
-        if amount < 1000:
-            await update.message.reply_text(
-                "❌ Minimum withdrawal is ₦1,000",
-                reply_markup=get_main_menu_keyboard()
-            )
-            return
-        
-        user_data = get_user(user_id)
-        balance_naira = user_data.get("points", 0) * POINTS_TO_NAIRA
-        
-        if amount > balance_naira:
-            await update.message.reply_text(
-                f"❌ Insufficient balance. Your current balance is ₦{balance_naira:,.2f}",
-                reply_markup=get_main_menu_keyboard()
-            )
-            return
-        
-        # Process withdrawal
-        withdrawal_id = str(datetime.now().timestamp())
-        withdrawal_data = {
-            "user_id": str(user_id),
-            "amount": amount,
-            "status": "pending",
-            "date": datetime.utcnow().isoformat(),
-            "account_details": {
-                "bank": user_data.get("bank_name"),
-                "account_number": user_data.get("account_number"),
-                "account_name": user_data.get("account_name")
-            }
-        }
-        
-        # Save withdrawal record
-        withdrawals = load_withdrawals()
-        withdrawals[withdrawal_id] = withdrawal_data
-        save_withdrawals(withdrawals)
-        
-        # Deduct from user balance
-        user_data["points"] = max(0, user_data.get("points", 0) - (amount / POINTS_TO_NAIRA))
-        user_data["total_withdrawn"] = user_data.get("total_withdrawn", 0) + amount
-        user_data["total_earned"] = user_data.get("total_earned", 0) + amount
-        update_user(user_id, user_data)
-        
-        # Notify admin
-        if ADMIN_CHAT_ID:
-            try:
-                await context.bot.send_message(
-                    chat_id=ADMIN_CHAT_ID,
-                    text=f"🔄 New Withdrawal Request:\n\n"
-                         f"User: @{update.effective_user.username or update.effective_user.first_name}\n"
-                         f"User ID: {user_id}\n"
-                         f"Amount: ₦{amount:,.2f}\n"
-                         f"Bank: {user_data.get('bank_name')}\n"
-                         f"Account Number: {user_data.get('account_number')}\n"
-                         f"Account Name: {user_data.get('account_name')}\n\n"
-                         f"Withdrawal ID: {withdrawal_id}"
-                )
-            except Exception as e:
-                logger.error(f"Error sending admin notification: {e}")
-        
-        await update.message.reply_text(
-            f"✅ Withdrawal request of ₦{amount:,.2f} submitted successfully!\n\n"
-            "Your request will be processed within 24 hours.\n"
-            "Use '📋 Withdrawals' to check your withdrawal history.",
-            reply_markup=get_main_menu_keyboard()
-        )
-        
-        context.user_data["awaiting_withdrawal_amount"] = False
-    
-    except ValueError:
-        await update.message.reply_text(
-            "❌ Invalid amount. Please enter a valid number.",
-            reply_markup=get_main_menu_keyboard()
-        )
-
-async def withdrawals(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    withdrawals = load_withdrawals()
-    user_withdrawals = [w for w in withdrawals.values() if w["user_id"] == str(user_id)]
-    
-    if not user_withdrawals:
-        await update.message.reply_text(
-            "You have no withdrawal records yet.",
-            reply_markup=get_main_menu_keyboard()
-        )
-        return
-    
-    total_withdrawn = user_data.get("total_withdrawn", 0)
-    total_earned = user_data.get("total_earned", 0)
-    
-    message = "📝 Your Withdrawal History:\n\n"
-    for w in sorted(user_withdrawals, key=lambda x: x["date"], reverse=True):
-        try:
-            date = datetime.fromisoformat(w["date"]).strftime("%Y-%m-%d %H:%M")
-            message += (
-                f"💰 Amount: ₦{w['amount']:,.2f}\n"
-                f"📅 Date: {date}\n"
-                f"🔄 Status: {w.get('status', 'pending')}\n"
-                f"🏦 Bank: {w['account_details']['bank']}\n"
-                f"🔢 Account: {w['account_details']['account_number']}\n\n"
-            )
-        except Exception as e:
-            logger.error(f"Error formatting withdrawal record: {e}")
-            continue
-    
-    message += f"💵 Total Withdrawn: ₦{total_withdrawn:,.2f}\n"
-    message += f"💸 Total Earned: ₦{total_earned:,.2f}"
-    
-    await update.message.reply_text(
-        message,
-        reply_markup=get_main_menu_keyboard()
-    )
-
-async def level(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    level_name, level_num = calculate_level(user_data)
-    referrals = user_data.get("referrals", 0)
-    total_earned = user_data.get("total_earned", 0)
-    
-    message = (
-        f"🏆 Your Level: {level_name} (Level {level_num})\n\n"
-        f"👥 Referrals: {referrals}\n"
-        f"💰 Total Earned: ₦{total_earned:,.2f}\n\n"
-    )
-    
-    # Show next level requirements
-    if level_num == 1:
-        message += "Next Level (Amateur) Requirements:\n- 20 referrals\n- ₦2,500 total earned"
-    elif level_num == 2:
-        message += "Next Level (Pro) Requirements:\n- 50 referrals\n- ₦5,000 total earned"
-    elif level_num == 3:
-        message += "Next Level (Master) Requirements:\n- 75 referrals\n- ₦7,500 total earned"
-    elif level_num == 4:
-        message += "Next Level (Guru) Requirements:\n- 100 referrals\n- ₦10,000 total earned"
-    else:
-        message += "You've reached the highest level!"
-    
-    await update.message.reply_text(
-        message,
-        reply_markup=get_main_menu_keyboard()
-    )
-
-async def daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    if has_claimed_today(user_data, "daily_bonus"):
-        await update.message.reply_text(
-            "❌ You've already claimed your daily bonus today. Come back tomorrow!",
-            reply_markup=get_main_menu_keyboard()
-        )
-        return
-    
-    # Award daily bonus
-    user_data["points"] = user_data.get("points", 0) + DAILY_BONUS_AMOUNT
-    user_data["total_earned"] = user_data.get("total_earned", 0) + DAILY_BONUS_AMOUNT
-    mark_claimed_today(user_data, "daily_bonus")
-    update_user(user_id, user_data)
-    
-    await update.message.reply_text(
-        f"🎁 You've claimed your daily bonus of ₦{DAILY_BONUS_AMOUNT}!\n"
-        f"💰 Your new balance: ₦{(user_data.get('points', 0) * POINTS_TO_NAIRA):,.2f}",
-        reply_markup=get_main_menu_keyboard()
-    )
-
-# --- Run Bot ---
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-
-    # Command handlers
-    app.add_handler(CommandHandler("start", start))
-    
-    # Callback query handlers
-    app.add_handler(CallbackQueryHandler(confirm_twitter, pattern="^confirm_twitter$"))
-    app.add_handler(CallbackQueryHandler(verify_tasks, pattern="^verify_tasks$"))
-    
-    # Message handlers
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
-    app.add_handler(MessageHandler(filters.PHOTO, handle_task_proof))
-
-    # Error handler
-    app.add_error_handler(error_handler)
-    
-    app.run_polling()
-
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.error(f"Update {update} caused error {context.error}")
-    
-    if update and update.effective_user:
-        await context.bot.send_message(
-            chat_id=update.effective_user.id,
-            text="❌ An error occurred but it's fine.\n\nContinue with the menu below...",
-            reply_markup=get_main_menu_keyboard()
-        )
-
-if __name__ == "__main__":
-    main()
+# bot.py
+
+import os
+import sys
+import copy
+import json
+import sqlite3
+import asyncio
+import heapq
+import bisect
+import logging
+import itertools
+import zlib
+import queue
+import re
+import mmap
+import codecs
+import csv
+import tempfile
+import hashlib
+import random
+import io
+import cProfile
+import pstats
+import logging.handlers
+import functools
+import contextlib
+import time
+import signal
+import threading
+import multiprocessing
+from datetime import date, datetime, timedelta, timezone
+import urllib.parse
+from enum import Enum, IntEnum
+from collections import Counter, OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from dotenv import load_dotenv
+from sortedcontainers import SortedList
+from PIL import Image
+from prometheus_client import REGISTRY, Counter as MetricCounter, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from flask import Flask, request, abort
+from werkzeug.serving import make_server
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram.ext import (
+    ApplicationBuilder, BaseRateLimiter, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+)
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
+TWITTER_HANDLE = os.getenv("TWITTER_HANDLE")
+BOT_USERNAME = "UtilizersBot"
+ADMIN_CHAT_ID = os.getenv("ADMIN_ID")  # Add this to your .env file
+
+# Conversion rate (points to Naira)
+POINTS_TO_NAIRA = 1  # 1 point = 1 Naira
+DAILY_BONUS_AMOUNT = 25  # 25 Naira daily bonus
+
+# Seconds between background flushes of changed user records to disk
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "5"))
+# Read DATA_FILE record by record in the background at startup, serving
+# requests meanwhile (json backend); 0 loads it in one go before starting
+STREAM_LOAD = os.getenv("STREAM_LOAD", "1") == "1"
+# Users kept in memory by backends that don't preload (sqlite): past this the
+# least recently used unchanged records are dropped. Also caps how many
+# unknown user ids are remembered as missing
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+# Storage engine: "json" (DATA_FILE/WITHDRAWAL_FILE) or "sqlite" (SQLITE_FILE)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_FILE = os.getenv("SQLITE_FILE", "bot_data.db")
+# Updates processed in parallel; 1 keeps strictly sequential processing
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
+
+# Update delivery: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public https base URL, e.g. https://yourapp.herokuapp.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # Telegram allows 1-100
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))  # Updates queued or in flight before we push back
+PORT = int(os.getenv("PORT", "8443"))
+
+# Prometheus metrics: served on their own port, never the public webhook
+# port; keep METRICS_PORT private to your network (0 disables)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Slow-update profiling (toggle at runtime with /profile). A PROFILE_SAMPLE_RATE
+# fraction of updates is run under cProfile; any update slower than
+# SLOW_UPDATE_THRESHOLD seconds gets a stack-sample summary. Both go to SLOW_UPDATE_LOG.
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+SLOW_UPDATE_THRESHOLD = float(os.getenv("SLOW_UPDATE_THRESHOLD", "2"))
+SLOW_UPDATE_LOG = os.getenv("SLOW_UPDATE_LOG", "slow_updates.log")
+
+# Channel membership cache: members are trusted for longer than non-members,
+# who are probably about to join and tap Verify again
+MEMBERSHIP_TTL = float(os.getenv("MEMBERSHIP_TTL", "600"))
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "10"))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "100000"))
+
+# Withdrawal alerts to the admin are batched into digests, sent once this many
+# are queued or the oldest has waited this many seconds
+ADMIN_DIGEST_MAX_ITEMS = int(os.getenv("ADMIN_DIGEST_MAX_ITEMS", "20"))
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", "30"))
+ADMIN_NOTIFY_MAX_RETRIES = int(os.getenv("ADMIN_NOTIFY_MAX_RETRIES", "5"))
+
+# /pending withdrawal console: items per page, and how long status-change
+# notices to users are collected before they go out (one message per user)
+PENDING_PAGE_SIZE = int(os.getenv("PENDING_PAGE_SIZE", "8"))
+WITHDRAWAL_NOTICE_INTERVAL = float(os.getenv("WITHDRAWAL_NOTICE_INTERVAL", "5"))
+
+# Outbound Bot API limits. Telegram allows about 30 messages/s overall,
+# 1/s per private chat (short bursts are fine) and 20/min per group.
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE_PER_MINUTE", "20")) / 60
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# /broadcast: recipients are read from the user store this many at a time and
+# at most BROADCAST_CONCURRENCY sends are in flight (the scheduler sets the pace)
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "50"))
+BROADCAST_CHECKPOINT = os.getenv("BROADCAST_CHECKPOINT", "broadcast_checkpoint.json")
+
+# Level tiers: [name, level, min referrals, min total earned]. A user needs
+# both minimums. Override with a JSON list in LEVEL_TIERS.
+DEFAULT_LEVEL_TIERS = [
+    ["Novice", 1, 0, 0],
+    ["Amateur", 2, 20, 2500],
+    ["Pro", 3, 50, 5000],
+    ["Master", 4, 75, 7500],
+    ["Guru", 5, 100, 10000],
+]
+LEVEL_TIERS = json.loads(os.getenv("LEVEL_TIERS")) if os.getenv("LEVEL_TIERS") else DEFAULT_LEVEL_TIERS
+
+# Daily claims reset at this hour (UTC); claim history is kept in memory for CLAIM_RETENTION_DAYS
+DAY_BOUNDARY_HOUR = int(os.getenv("DAY_BOUNDARY_HOUR", "0"))
+CLAIM_RETENTION_DAYS = int(os.getenv("CLAIM_RETENTION_DAYS", "7"))
+
+# Task proof screenshots: downloaded by PROOF_WORKERS background workers into
+# PROOF_DIR (named by content hash) and listed for review in PROOF_LOG
+PROOF_DIR = os.getenv("PROOF_DIR", "proofs")
+PROOF_LOG = os.getenv("PROOF_LOG", "proofs.jsonl")
+PROOF_WORKERS = int(os.getenv("PROOF_WORKERS", "4"))
+PROOF_MAX_RETRIES = int(os.getenv("PROOF_MAX_RETRIES", "3"))
+PROOF_DRAIN_TIMEOUT = float(os.getenv("PROOF_DRAIN_TIMEOUT", "30"))  # Seconds to finish queued downloads on shutdown
+# Perceptual hashes of stored proofs, for spotting reused screenshots. Proofs
+# within PROOF_DUPLICATE_DISTANCE bits (of 64) of an earlier one are flagged.
+PROOF_HASH_FILE = os.getenv("PROOF_HASH_FILE", "proof_hashes.txt")
+PROOF_DUPLICATE_DISTANCE = int(os.getenv("PROOF_DUPLICATE_DISTANCE", "6"))
+PROOF_HASH_PROCESSES = int(os.getenv("PROOF_HASH_PROCESSES", "2"))
+
+# Logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+DATA_FILE = "user_data.json"
+# Changed user records are appended to numbered journal files next to the
+# DATA_FILE snapshot and merged into it once they pass JOURNAL_COMPACT_BYTES
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "user_data.journal")
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(32 * 1024 * 1024)))
+# Number of user shards, written by `python bot.py reshard N` (missing = 1,
+# which uses DATA_FILE and JOURNAL_FILE themselves)
+SHARD_FILE = os.getenv("SHARD_FILE", "user_data.shards")
+WITHDRAWAL_FILE = "withdrawals.json"
+WITHDRAWAL_LOG = os.getenv("WITHDRAWAL_LOG", "withdrawals.jsonl")
+
+# --- Metrics ---
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Handler latency, including waiting for the user's lock", ["handler"])
+HANDLER_ERRORS = MetricCounter("bot_handler_errors", "Exceptions raised by handlers", ["handler"])
+STORAGE_LATENCY = Histogram("bot_storage_seconds", "Storage operation latency", ["op"])
+STORAGE_BYTES = MetricCounter("bot_storage_bytes", "Bytes read or written by storage operations", ["op"])
+API_LATENCY = Histogram("bot_api_seconds", "Bot API request latency", ["endpoint"])
+SEND_WAIT = Histogram("bot_outbound_wait_seconds", "Time outbound requests wait in the scheduler queue", ["priority"])
+
+def timed_storage(op):
+    """Time calls under the storage op label ``op``. On RecordLog methods the
+    label may contain {name}, filled in from the log's name."""
+    def decorator(fn):
+        if "{name}" in op:
+            @functools.wraps(fn)
+            def wrapper(self, *args, **kwargs):
+                with STORAGE_LATENCY.labels(op.format(name=self.name)).time():
+                    return fn(self, *args, **kwargs)
+            return wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STORAGE_LATENCY.labels(op).time():
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrumented(handler):
+    """Record latency and errors of ``handler`` under its function name."""
+    name = handler.__name__
+    latency = HANDLER_LATENCY.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            if profiler.enabled:
+                async with profiler.track(update, name):
+                    return await handler(update, context)
+            return await handler(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start)
+    return wrapper
+
+# --- Profiling ---
+def describe_update(update):
+    if getattr(update, "callback_query", None) is not None:
+        return f"callback_query:{update.callback_query.data}"
+    message = getattr(update, "message", None)
+    if message is None:
+        return "other"
+    if message.photo:
+        return "photo"
+    if message.text and message.text.startswith("/"):
+        return f"command:{message.text.split()[0]}"
+    return "text"
+
+class UpdateProfiler:
+    """Profiles sampled updates with cProfile and stack-samples slow ones.
+
+    cProfile sees everything on the event loop thread, so only one sampled
+    profile runs at a time. Slow updates are caught by a watchdog thread that
+    samples the loop thread's stack while an update is past the threshold;
+    that shows what blocked the loop, or the await point when it was idle.
+    """
+
+    SAMPLE_INTERVAL = 0.01
+    STACK_DEPTH = 8
+
+    def __init__(self, enabled=PROFILE_ENABLED, sample_rate=PROFILE_SAMPLE_RATE,
+                 threshold=SLOW_UPDATE_THRESHOLD, log_file=SLOW_UPDATE_LOG):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.log_file = log_file
+        self.profiled = 0
+        self.slow = 0
+        self._profile = None
+        self._active = {}  # task -> [start, handler name, Counter of stacks]
+        self._lock = threading.Lock()
+        self._log = None
+        self._loop_thread = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def _logger(self):
+        if self._log is None:
+            self._log = logging.getLogger(f"{__name__}.slow_updates")
+            self._log.propagate = False
+            handler = logging.handlers.RotatingFileHandler(self.log_file, maxBytes=5_000_000, backupCount=3)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._log.addHandler(handler)
+        return self._log
+
+    def start(self):
+        """Call from the event loop thread. The watchdog only runs while
+        profiling is enabled; enable() and disable() start and stop it."""
+        self._loop_thread = threading.get_ident()
+        if self.enabled:
+            self._start_watchdog()
+
+    def stop(self):
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def enable(self):
+        self.enabled = True
+        if self._loop_thread is not None:
+            self._start_watchdog()
+
+    def disable(self):
+        self.enabled = False
+        self.stop()
+
+    def _start_watchdog(self):
+        if self._watchdog is None:
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="slow-update-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def _frame_stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.STACK_DEPTH:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def _await_stack(self, task):
+        # Follow the await chain down to the innermost suspended coroutine
+        stack = []
+        coro = task.get_coro() if task is not None else None
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}")
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        return tuple(stack[-self.STACK_DEPTH:])
+
+    def _watch(self):
+        while not self._stop.wait(self.SAMPLE_INTERVAL):
+            if not self.enabled or not self.threshold or not self._active:
+                continue
+            now = time.perf_counter()
+            with self._lock:
+                slow = [(task, entry) for task, entry in self._active.items() if now - entry[0] >= self.threshold]
+            if not slow:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            loop_stack = self._frame_stack(frame) if frame is not None else ()
+            for task, entry in slow:
+                # When the loop is idle the task is parked at an await; record where
+                if loop_stack and "select" in loop_stack[-1]:
+                    key = ("(awaiting)",) + self._await_stack(task)
+                else:
+                    key = loop_stack
+                entry[2][key] += 1
+
+    @contextlib.asynccontextmanager
+    async def track(self, update, handler_name):
+        task = asyncio.current_task()
+        profile = None
+        if self.sample_rate and self._profile is None and random.random() < self.sample_rate:
+            profile = self._profile = cProfile.Profile()
+            profile.enable()
+        entry = [time.perf_counter(), handler_name, Counter()]
+        with self._lock:
+            self._active[task] = entry
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - entry[0]
+            with self._lock:
+                self._active.pop(task, None)
+            if profile is not None:
+                profile.disable()
+                self._profile = None
+                self.profiled += 1
+                self._write(update, handler_name, elapsed, profile=profile)
+            elif self.threshold and elapsed >= self.threshold:
+                self.slow += 1
+                self._write(update, handler_name, elapsed, stacks=entry[2])
+
+    def _write(self, update, handler_name, elapsed, profile=None, stacks=None):
+        user = getattr(update, "effective_user", None)
+        lines = [
+            f"{'PROFILED' if profile is not None else 'SLOW'} {handler_name} "
+            f"update={describe_update(update)} user={user.id if user else '-'} took {elapsed * 1000:.0f} ms"
+        ]
+        if profile is not None:
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(25)
+            lines.append(out.getvalue().rstrip())
+        elif stacks:
+            total = sum(stacks.values())
+            for stack, hits in stacks.most_common(5):
+                lines.append(f"  {hits}/{total} samples:")
+                lines.extend(f"    {frame}" for frame in stack)
+        else:
+            lines.append("  (no samples; the time was spent before the threshold was reached)")
+        try:
+            self._logger().info("\n".join(lines))
+        except Exception as e:
+            logger.error(f"Error writing slow update log: {e}")
+
+    def summary(self):
+        return (
+            f"Profiling: {'on' if self.enabled else 'off'}\n"
+            f"Sample rate: {self.sample_rate:g}\n"
+            f"Slow threshold: {self.threshold:g}s\n"
+            f"Profiled: {self.profiled} | Slow: {self.slow}\n"
+            f"Log: {self.log_file}"
+        )
+
+profiler = UpdateProfiler()
+
+# --- Utility Functions ---
+@timed_storage("load_users")
+def load_data(path=DATA_FILE):
+    try:
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                STORAGE_BYTES.labels("load_users").inc(os.fstat(f.fileno()).st_size)
+                return json.load(f)
+    except Exception as e:
+        logger.error(f"Error loading data: {e}")
+    return {}
+
+KEY_SEPARATOR = re.compile(r"\s*:\s*")
+
+def iter_data(path=DATA_FILE, chunk_size=1 << 20):
+    """Yield (user id, record, bytes read so far) from a JSON object file one
+    record at a time, so only one chunk of text is held at once."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        buffer, pos, read, eof, started = "", 0, 0, False, False
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            # A record must be followed by at least one more character, or a
+            # number could have been cut off at the end of the chunk
+            incomplete = pos >= len(buffer) - 1 and not eof
+            if not incomplete:
+                if pos >= len(buffer):
+                    if not started:
+                        return  # Empty file: no users yet
+                    raise ValueError("Unexpected end of user data")
+                if not started:
+                    if buffer[pos] != "{":
+                        raise ValueError("User data is not a JSON object")
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "}":
+                    return
+                try:
+                    key, end = decoder.raw_decode(buffer, pos)
+                    separator = KEY_SEPARATOR.match(buffer, end)
+                    if separator is None:
+                        raise json.JSONDecodeError("Expecting ':'", buffer, end)
+                    value, end = decoder.raw_decode(buffer, separator.end())
+                    if end < len(buffer) or eof:
+                        yield key, value, read
+                        pos = end
+                        continue
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+            chunk = f.read(chunk_size)
+            read += len(chunk)
+            eof = not chunk
+            buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+
+@timed_storage("find_user")
+def find_data(key, path=DATA_FILE):
+    """Read one user's record straight out of a JSON object file, without
+    parsing the rest. Returns None if the user isn't in it."""
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = data.find(b'"' + key.encode() + b'":')
+            if pos < 0:
+                return None
+            start = pos + len(key) + 3
+            decoder = json.JSONDecoder()
+            size = 4096
+            while True:
+                text = data[start:start + size].decode("utf-8", "ignore").lstrip()
+                try:
+                    return decoder.raw_decode(text)[0]
+                except json.JSONDecodeError:
+                    if start + size >= len(data):
+                        return None
+                    size *= 4
+    except (OSError, ValueError) as e:
+        logger.error(f"Error looking up user {key}: {e}")
+        return None
+
+def fsync_dir(path):
+    """Make a rename of ``path`` durable."""
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def trim_torn_tail(path):
+    """Cut a half-written last line (left by a crash mid-append) off the
+    line-per-record log at ``path``, so the next append starts a fresh line
+    instead of being glued onto the fragment. Returns the bytes removed."""
+    try:
+        f = open(path, "r+b")
+    except FileNotFoundError:
+        return 0
+    with f:
+        size = end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+            logger.error(f"Dropped a torn {size - end}-byte line at the end of {path}")
+    return size - end
+
+class DataWriter:
+    """Writes (user id, record) pairs as a DATA_FILE-style JSON object to a
+    temp file; close() fsyncs it and moves it over ``path``."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path + ".tmp", "w")
+        self._file.write("{")
+
+    def write(self, key, info):
+        self._file.write(f'{"," if self.count else ""}\n    {json.dumps(key)}: {json.dumps(info, default=dict)}')
+        self.count += 1
+
+    def close(self):
+        self._file.write("\n}\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+        fsync_dir(self.path)
+
+def write_data(path, items):
+    """Write (user id, record) pairs to ``path`` atomically. Returns the record count."""
+    writer = DataWriter(path)
+    for key, info in items:
+        writer.write(key, info)
+    writer.close()
+    return writer.count
+
+def read_shard_count():
+    try:
+        with open(SHARD_FILE) as f:
+            return int(json.load(f)["shards"])
+    except FileNotFoundError:
+        return 1
+
+def shard_paths(shard, shards):
+    """(snapshot, journal prefix) of one user shard."""
+    if shards == 1:
+        return DATA_FILE, JOURNAL_FILE
+    base, ext = os.path.splitext(DATA_FILE)
+    suffix = f"{shard:03d}-of-{shards:03d}"
+    return f"{base}.{suffix}{ext}", f"{JOURNAL_FILE}.{suffix}"
+
+def shard_of(key, shards):
+    return zlib.crc32(key.encode()) % shards if shards > 1 else 0
+
+class UserJournal:
+    """Append-only log of changed user records, one JSON line per record,
+    split into numbered generations (JOURNAL_FILE.000001, ...).
+
+    Each flush is one write and one fsync. Once the current generation
+    passes ``compact_bytes`` a new one is started and a background thread
+    merges the snapshot with the closed generations into a new snapshot,
+    swaps it in with os.replace and deletes them. Records are complete, so
+    replaying a generation the snapshot already contains is harmless.
+    """
+
+    def __init__(self, prefix=JOURNAL_FILE, snapshot=DATA_FILE, compact_bytes=JOURNAL_COMPACT_BYTES):
+        self.prefix = prefix
+        self.snapshot = snapshot
+        self.compact_bytes = compact_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._generation = 0
+        self._compactor = None
+
+    def generations(self):
+        directory = os.path.dirname(os.path.abspath(self.prefix))
+        name = os.path.basename(self.prefix) + "."
+        found = []
+        for entry in os.listdir(directory):
+            if entry.startswith(name) and entry[len(name):].isdigit():
+                found.append(int(entry[len(name):]))
+        return sorted(found)
+
+    def _path(self, generation):
+        return f"{self.prefix}.{generation:06d}"
+
+    def replay(self):
+        """Records from every generation, oldest first, so the newest line per user wins."""
+        records = {}
+        for generation in self.generations():
+            with open(self._path(generation), "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        records[entry["id"]] = entry["record"]
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        logger.error(f"Skipping bad journal line in {self._path(generation)}")
+        if records:
+            logger.info(f"Replayed {len(records)} users from {self.prefix}")
+        return records
+
+    def open(self):
+        generations = self.generations()
+        self._generation = generations[-1] if generations else 1
+        trim_torn_tail(self._path(self._generation))
+        self._file = open(self._path(self._generation), "ab")
+
+    @timed_storage("save_users")
+    def append(self, records):
+        lines = b"".join(
+            (json.dumps({"id": key, "record": info}, default=dict) + "\n").encode() for key, info in records.items()
+        )
+        with self._lock:
+            if self._file is None:
+                self.open()
+            self._file.write(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            rotate = self._file.tell() >= self.compact_bytes and self._compactor is None
+            if rotate:
+                self._file.close()
+                self._generation += 1
+                self._file = open(self._path(self._generation), "ab")
+        STORAGE_BYTES.labels("save_users").inc(len(lines))
+        if rotate:
+            self._compactor = threading.Thread(target=self.compact, args=(self._generation - 1,),
+                                               name="journal-compactor", daemon=True)
+            self._compactor.start()
+
+    def compact(self, upto):
+        """Merge the snapshot with generations up to ``upto`` into a new snapshot."""
+        try:
+            started = time.perf_counter()
+            closed = [generation for generation in self.generations() if generation <= upto]
+            changes = {}
+            for generation in closed:
+                with open(self._path(generation), "rb") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                            changes[entry["id"]] = entry["record"]
+                        except ValueError:
+                            pass
+
+            def merged():
+                if os.path.exists(self.snapshot):
+                    for key, info, _ in iter_data(self.snapshot):
+                        yield key, changes.pop(key, info)
+                yield from changes.items()
+
+            count = write_data(self.snapshot, merged())
+            for generation in closed:
+                os.remove(self._path(generation))
+            logger.info(f"Compacted {len(closed)} journal file(s) into {self.snapshot} "
+                        f"({count} users, {time.perf_counter() - started:.1f}s)")
+        except Exception as e:
+            logger.error(f"Error compacting user journal: {e}")
+        finally:
+            self._compactor = None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class RecordLog:
+    """Append-only log of JSON records, one line per write.
+
+    Only byte offsets are kept in memory: the latest line for each record id,
+    plus record ids ordered by date, overall and per user. Changing a record
+    appends a new line; the newest line for an id wins. Records need
+    "user_id" and "date" fields. Storage metrics are reported under labels built from
+    ``name`` (load_<name>_index, append_<name>, user_<name>s, load_<name>s).
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self._offsets = {}
+        self._by_user = {}
+        self._by_date = SortedList()  # (date, id), oldest first
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _index(self, record_id, record, offset):
+        if record_id not in self._offsets:
+            key = (record["date"], record_id)  # One tuple shared by both indexes
+            bisect.insort(self._by_user.setdefault(str(record["user_id"]), []), key)
+            self._by_date.add(key)
+        self._offsets[record_id] = offset
+
+    def _clear(self):
+        self._offsets.clear()
+        self._by_user.clear()
+        self._by_date.clear()
+
+    def _prepare(self):
+        """Called under the lock before the log is first indexed."""
+
+    @timed_storage("load_{name}_index")
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._prepare()
+            self._clear()
+            # Appends go after the last complete line, not onto a torn one
+            trim_torn_tail(self.path)
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    offset = 0
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                            self._index(entry["id"], entry["record"], offset)
+                        except Exception as e:
+                            logger.error(f"Skipping bad line at {offset} of {self.path}: {e}")
+                        offset += len(line)
+                STORAGE_BYTES.labels(f"load_{self.name}_index").inc(offset)
+            self._loaded = True
+        logger.info(f"Indexed {len(self._offsets)} records from {self.path}")
+
+    def _read_at(self, f, offset):
+        f.seek(offset)
+        return json.loads(f.readline())["record"]
+
+    @timed_storage("append_{name}")
+    def append(self, record_id, record):
+        self.load()
+        line = (json.dumps({"id": record_id, "record": record}) + "\n").encode()
+        with self._lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._index(record_id, record, offset)
+        STORAGE_BYTES.labels(f"append_{self.name}").inc(len(line))
+
+    @timed_storage("user_{name}s")
+    def for_user(self, user_id):
+        self.load()
+        with self._lock:
+            entries = list(self._by_user.get(str(user_id), ()))
+            offsets = [self._offsets[record_id] for _, record_id in reversed(entries)]
+        if not offsets:
+            return []
+        with open(self.path, "rb") as f:
+            return [self._read_at(f, offset) for offset in offsets]
+
+    def iter_latest(self):
+        """Stream the current version of every record, in log order, without
+        holding them all in memory."""
+        self.load()
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                position, offset = offset, offset + len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                # Checked under the lock: a line is written and indexed under
+                # it, so a newer line for this id is one this pass still reaches
+                with self._lock:
+                    latest = self._offsets.get(entry["id"]) == position
+                if latest:
+                    yield entry["id"], entry["record"]
+
+    def iter_records(self, record_ids):
+        """Yield (id, current record) for each of ``record_ids``, in that order."""
+        self.load()
+        with self._lock:
+            offsets = [(record_id, self._offsets[record_id]) for record_id in record_ids]
+        if not offsets:
+            return
+        with open(self.path, "rb") as f:
+            for record_id, offset in offsets:
+                yield record_id, self._read_at(f, offset)
+
+    def _walk(self, keys, start, end, page_size=1000):
+        # Resumes after the last key of each page, so records added or
+        # removed in between don't shift the walk
+        lower, inclusive = ((start,) if start else None), True
+        upper = (end,) if end else None
+        while True:
+            with self._lock:
+                page = list(itertools.islice(keys.irange(lower, upper, inclusive=(inclusive, False)), page_size))
+            if not page:
+                return
+            yield from self.iter_records(record_id for _, record_id in page)
+            lower, inclusive = page[-1], False
+
+    def iter_by_date(self, start=None, end=None):
+        """Yield (id, current record) with ``start`` <= date < ``end`` (ISO
+        strings, either optional), oldest first, a page of keys at a time."""
+        self.load()
+        return self._walk(self._by_date, start, end)
+
+    @timed_storage("load_{name}s")
+    def read_all(self):
+        self.load()
+        with self._lock:
+            offsets = dict(self._offsets)
+        if not offsets:
+            return {}
+        with open(self.path, "rb") as f:
+            return {record_id: self._read_at(f, offset) for record_id, offset in offsets.items()}
+
+    def _rewrite(self, items):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for record_id, record in items:
+                f.write(json.dumps({"id": record_id, "record": record}) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def replace_all(self, data):
+        """Rewrite the log so it holds exactly ``data`` (one line per record)."""
+        with self._lock:
+            self._rewrite(data.items())
+            self._loaded = False
+        self.load()
+
+class WithdrawalLog(RecordLog):
+    """RecordLog of withdrawals. Pending records are also kept ordered by
+    date so they can be paged through, and a legacy withdrawals.json is
+    migrated on first load."""
+
+    def __init__(self, path, legacy_file=WITHDRAWAL_FILE):
+        super().__init__(path, "withdrawal")
+        self.legacy_file = legacy_file
+        self._pending = SortedList()  # (date, id) of pending records, oldest first
+        self._pending_keys = {}
+
+    def _index(self, withdrawal_id, withdrawal_data, offset):
+        super()._index(withdrawal_id, withdrawal_data, offset)
+        if withdrawal_data.get("status", "pending") == "pending":
+            if withdrawal_id not in self._pending_keys:
+                key = self._pending_keys[withdrawal_id] = (withdrawal_data["date"], withdrawal_id)
+                self._pending.add(key)
+        elif withdrawal_id in self._pending_keys:
+            self._pending.remove(self._pending_keys.pop(withdrawal_id))
+
+    def _clear(self):
+        super()._clear()
+        self._pending.clear()
+        self._pending_keys.clear()
+
+    def _prepare(self):
+        if not os.path.exists(self.path) and self.legacy_file and os.path.exists(self.legacy_file):
+            self._migrate_json()
+
+    def _migrate_json(self):
+        try:
+            with open(self.legacy_file, "r") as f:
+                withdrawals = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading withdrawals: {e}")
+            return
+        ordered = sorted(withdrawals.items(), key=lambda item: item[1]["date"])
+        self._rewrite(ordered)
+        logger.info(f"Migrated {len(withdrawals)} withdrawals from {self.legacy_file} to {self.path}")
+
+    def pending_count(self):
+        self.load()
+        return len(self._pending)
+
+    def iter_pending(self, start=None, end=None):
+        """iter_by_date() over the pending records only."""
+        self.load()
+        return self._walk(self._pending, start, end)
+
+    @timed_storage("pending_withdrawals")
+    def pending_page(self, offset, limit):
+        """(id, record) of pending records ``offset`` to ``offset + limit``, oldest first."""
+        self.load()
+        with self._lock:
+            entries = [(withdrawal_id, self._offsets[withdrawal_id])
+                       for _, withdrawal_id in self._pending[offset:offset + limit]]
+        if not entries:
+            return []
+        with open(self.path, "rb") as f:
+            return [(withdrawal_id, self._read_at(f, position)) for withdrawal_id, position in entries]
+
+    @timed_storage("set_withdrawal_status")
+    def set_status_many(self, withdrawal_ids, status, **fields):
+        """Move the given pending records to ``status`` with a single append
+        and return the updated (id, record) pairs. Records that are no longer
+        pending are left alone."""
+        self.load()
+        with self._lock:
+            targets = [(withdrawal_id, self._offsets[withdrawal_id])
+                       for withdrawal_id in dict.fromkeys(withdrawal_ids) if withdrawal_id in self._pending_keys]
+            if not targets:
+                return []
+            with open(self.path, "rb") as f:
+                changed = [(withdrawal_id, self._read_at(f, position)) for withdrawal_id, position in targets]
+            lines = []
+            for withdrawal_id, withdrawal_data in changed:
+                withdrawal_data.update(fields, status=status)
+                lines.append((json.dumps({"id": withdrawal_id, "record": withdrawal_data}) + "\n").encode())
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            for (withdrawal_id, withdrawal_data), line in zip(changed, lines):
+                self._index(withdrawal_id, withdrawal_data, offset)
+                offset += len(line)
+        STORAGE_BYTES.labels("set_withdrawal_status").inc(sum(len(line) for line in lines))
+        return changed
+
+class JsonBackend:
+    """Users split by crc32 of their id over SHARD_FILE's count of shards,
+    each a snapshot file plus a UserJournal of changes since; withdrawals in
+    the WITHDRAWAL_LOG append-only log. Users are loaded up front, one
+    thread per shard; a write appends only the changed records to their
+    shard's journal."""
+
+    preload = True
+
+    def __init__(self, shards=None):
+        self.withdrawals = WithdrawalLog(WITHDRAWAL_LOG)
+        self.shards = shards or read_shard_count()
+        self.snapshots = []
+        self.journals = []
+        for shard in range(self.shards):
+            snapshot, journal = shard_paths(shard, self.shards)
+            self.snapshots.append(snapshot)
+            self.journals.append(UserJournal(journal, snapshot))
+        self._recent = {}
+
+    def shard_of(self, key):
+        return shard_of(key, self.shards)
+
+    def _map_shards(self, fn, items):
+        with ThreadPoolExecutor(max_workers=self.shards, thread_name_prefix="shard") as pool:
+            return list(pool.map(fn, items))
+
+    def open(self):
+        self.withdrawals.load()
+        # Journal records are newer than the snapshots, so they're read first
+        # and the snapshots only fill in users they don't mention
+        self._recent = {}
+        for records in self._map_shards(UserJournal.replay, self.journals):
+            self._recent.update(records)
+        for journal in self.journals:
+            journal.open()
+
+    def load_users(self):
+        users = {}
+        for shard_users in self._map_shards(load_data, self.snapshots):
+            users.update(shard_users)
+        users.update(self._recent)
+        self._recent = {}
+        return users
+
+    def _read_shard(self, shard, batches, progress):
+        batch = []
+        try:
+            if os.path.exists(self.snapshots[shard]):
+                for key, info, read in iter_data(self.snapshots[shard]):
+                    batch.append((key, info))
+                    progress[shard] = read
+                    if len(batch) >= 1000:
+                        batches.put(batch)
+                        batch = []
+        finally:
+            # Records parsed before an error still go out; the error itself is
+            # raised to stream_users by reader.result()
+            batches.put(batch)
+            batches.put(None)
+
+    def stream_users(self):
+        """Yield (user id, record, bytes read) once per user: journal records
+        first, then the snapshots, read by one thread per shard."""
+        recent = self._recent
+        yield from ((key, info, 0) for key, info in recent.items())
+        batches = queue.Queue(maxsize=self.shards * 4)
+        progress = [0] * self.shards
+        with ThreadPoolExecutor(max_workers=self.shards, thread_name_prefix="shard") as pool:
+            readers = [pool.submit(self._read_shard, shard, batches, progress) for shard in range(self.shards)]
+            running = self.shards
+            while running:
+                batch = batches.get()
+                if batch is None:
+                    running -= 1
+                    continue
+                read = sum(progress)
+                for key, info in batch:
+                    if key not in recent:
+                        yield key, info, read
+            for reader in readers:
+                reader.result()
+        self._recent = {}
+
+    def data_size(self):
+        return sum(os.path.getsize(path) for path in self.snapshots if os.path.exists(path))
+
+    def find_user(self, key):
+        if key in self._recent:
+            return self._recent[key]
+        path = self.snapshots[self.shard_of(key)]
+        return find_data(key, path) if os.path.exists(path) else None
+
+    def write_users(self, records):
+        by_shard = {}
+        for key, info in records.items():
+            by_shard.setdefault(self.shard_of(key), {})[key] = info
+        for shard, shard_records in by_shard.items():
+            self.journals[shard].append(shard_records)
+
+    def close(self):
+        for journal in self.journals:
+            journal.close()
+
+    def load_withdrawals(self):
+        try:
+            return self.withdrawals.read_all()
+        except Exception as e:
+            logger.error(f"Error loading withdrawals: {e}")
+        return {}
+
+    def save_withdrawals(self, data):
+        self.withdrawals.replace_all(data)
+
+    def add_withdrawal(self, withdrawal_id, withdrawal_data):
+        self.withdrawals.append(withdrawal_id, withdrawal_data)
+
+    def get_user_withdrawals(self, user_id):
+        return self.withdrawals.for_user(user_id)
+
+    def count_pending_withdrawals(self):
+        return self.withdrawals.pending_count()
+
+    def pending_withdrawals(self, offset, limit):
+        return self.withdrawals.pending_page(offset, limit)
+
+    def set_withdrawal_status(self, withdrawal_ids, status, **fields):
+        return self.withdrawals.set_status_many(withdrawal_ids, status, **fields)
+
+    def export_withdrawals(self, status=None, start=None, end=None):
+        if not os.path.exists(self.withdrawals.path):
+            return
+
+        def matching():
+            # Walks the log's date index (just the pending one for the
+            # default export), so memory stays flat however long the log is
+            if status == "pending":
+                records = self.withdrawals.iter_pending(start, end)
+            else:
+                records = self.withdrawals.iter_by_date(start, end)
+            for withdrawal_id, w in records:
+                if not status or w.get("status", "pending") == status:
+                    yield withdrawal_id, w
+
+        # One pass to find the banks, then one date-ordered pass per bank
+        banks = {withdrawal_bank(w) for _, w in matching()}
+        for bank in sorted(banks):
+            yield from ((withdrawal_id, w) for withdrawal_id, w in matching() if withdrawal_bank(w) == bank)
+
+class SqliteBackend:
+    """Storage in a single SQLite database (WAL mode). Users are fetched by
+    primary key on demand and only changed rows are written."""
+
+    preload = False
+    shards = 1
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_withdrawals_user_date ON withdrawals (user_id, date);
+        CREATE INDEX IF NOT EXISTS idx_withdrawals_date ON withdrawals (date);
+        CREATE INDEX IF NOT EXISTS idx_withdrawals_status_date ON withdrawals (status, date);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def open(self):
+        pass
+
+    def shard_of(self, key):
+        return 0
+
+    def _conn(self):
+        # sqlite3 connections can't be shared across threads, so each worker
+        # thread (see asyncio.to_thread) gets its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load_users(self):
+        return {}
+
+    @timed_storage("get_user")
+    def get_user(self, key):
+        row = self._conn().execute("SELECT data FROM users WHERE id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def users_page(self, after, limit):
+        rows = self._conn().execute(
+            "SELECT id, data FROM users WHERE id > ? ORDER BY id LIMIT ?", (after or "", limit)
+        )
+        return [(key, json.loads(data)) for key, data in rows]
+
+    @timed_storage("save_users")
+    def write_users(self, records):
+        # Errors go to the caller: UserStore.flush keeps the records dirty and retries
+        rows = [(key, json.dumps(info, default=dict)) for key, info in records.items()]
+        with self._conn() as conn:
+            conn.executemany("INSERT OR REPLACE INTO users (id, data) VALUES (?, ?)", rows)
+        STORAGE_BYTES.labels("save_users").inc(sum(len(data) for _, data in rows))
+
+    @staticmethod
+    def _withdrawal_row(withdrawal_id, w):
+        return (withdrawal_id, str(w["user_id"]), w["date"], w.get("status", "pending"), json.dumps(w))
+
+    @timed_storage("load_withdrawals")
+    def load_withdrawals(self):
+        rows = self._conn().execute("SELECT id, data FROM withdrawals")
+        return {withdrawal_id: json.loads(data) for withdrawal_id, data in rows}
+
+    def save_withdrawals(self, data):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM withdrawals")
+            conn.executemany(
+                "INSERT INTO withdrawals (id, user_id, date, status, data) VALUES (?, ?, ?, ?, ?)",
+                [self._withdrawal_row(withdrawal_id, w) for withdrawal_id, w in data.items()]
+            )
+
+    @timed_storage("append_withdrawal")
+    def add_withdrawal(self, withdrawal_id, withdrawal_data):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO withdrawals (id, user_id, date, status, data) VALUES (?, ?, ?, ?, ?)",
+                self._withdrawal_row(withdrawal_id, withdrawal_data)
+            )
+
+    @timed_storage("user_withdrawals")
+    def get_user_withdrawals(self, user_id):
+        rows = self._conn().execute(
+            "SELECT data FROM withdrawals WHERE user_id = ? ORDER BY date DESC", (str(user_id),)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def count_pending_withdrawals(self):
+        return self._conn().execute("SELECT COUNT(*) FROM withdrawals WHERE status = 'pending'").fetchone()[0]
+
+    @timed_storage("pending_withdrawals")
+    def pending_withdrawals(self, offset, limit):
+        rows = self._conn().execute(
+            "SELECT id, data FROM withdrawals WHERE status = 'pending' ORDER BY date, id LIMIT ? OFFSET ?",
+            (limit, offset)
+        )
+        return [(withdrawal_id, json.loads(data)) for withdrawal_id, data in rows]
+
+    def export_withdrawals(self, status=None, start=None, end=None):
+        clauses, params = [], []
+        for clause, value in (("status = ?", status), ("date >= ?", start), ("date < ?", end)):
+            if value:
+                clauses.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # A separate connection, so the export doesn't hold this thread's cursor open
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            rows = conn.execute(
+                f"SELECT id, data FROM withdrawals {where} "
+                f"ORDER BY COALESCE(json_extract(data, '$.account_details.bank'), ''), date, id", params
+            )
+            for withdrawal_id, data in rows:
+                yield withdrawal_id, json.loads(data)
+        finally:
+            conn.close()
+
+    @timed_storage("set_withdrawal_status")
+    def set_withdrawal_status(self, withdrawal_ids, status, **fields):
+        changed = []
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for withdrawal_id in dict.fromkeys(withdrawal_ids):
+                row = conn.execute(
+                    "SELECT data FROM withdrawals WHERE id = ? AND status = 'pending'", (withdrawal_id,)
+                ).fetchone()
+                if row is None:
+                    continue
+                withdrawal_data = json.loads(row[0])
+                withdrawal_data.update(fields, status=status)
+                conn.execute(
+                    "UPDATE withdrawals SET status = ?, data = ? WHERE id = ?",
+                    (status, json.dumps(withdrawal_data), withdrawal_id)
+                )
+                changed.append((withdrawal_id, withdrawal_data))
+        return changed
+
+def reshard(shards):
+    """Redistribute users over ``shards`` snapshot files. Run with the bot
+    stopped: journals are folded in and the new layout starts without any."""
+    source = JsonBackend()
+    source.open()
+    if shards == source.shards:
+        logger.info(f"User data already has {shards} shard(s)")
+        return
+    target = JsonBackend(shards)
+    # Leftovers from an earlier, interrupted reshard to this layout
+    for journal in target.journals:
+        for generation in journal.generations():
+            os.remove(journal._path(generation))
+
+    writers = [DataWriter(snapshot) for snapshot in target.snapshots]
+    for key, info, _ in source.stream_users():
+        writers[target.shard_of(key)].write(key, info)
+    for writer in writers:
+        writer.close()
+
+    # Switching the shard count is the commit point; before it the old files are still in use
+    with open(SHARD_FILE + ".tmp", "w") as f:
+        json.dump({"shards": shards}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(SHARD_FILE + ".tmp", SHARD_FILE)
+    fsync_dir(SHARD_FILE)
+
+    source.close()
+    for journal in source.journals:
+        for generation in journal.generations():
+            os.remove(journal._path(generation))
+    for snapshot in source.snapshots:
+        if snapshot not in target.snapshots and os.path.exists(snapshot):
+            os.remove(snapshot)
+    logger.info(f"Resharded {sum(writer.count for writer in writers)} users from {source.shards} to {shards} shard(s)")
+
+def import_json_to_sqlite(path=SQLITE_FILE):
+    """One-shot migration of DATA_FILE and the withdrawal log into SQLite."""
+    backend = SqliteBackend(path)
+    source = JsonBackend()
+    source.open()
+    users = source.load_users()
+    backend.write_users(users)
+    withdrawals = source.load_withdrawals()
+    with backend._conn() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO withdrawals (id, user_id, date, status, data) VALUES (?, ?, ?, ?, ?)",
+            [backend._withdrawal_row(withdrawal_id, w) for withdrawal_id, w in withdrawals.items()]
+        )
+    logger.info(f"Imported {len(users)} users and {len(withdrawals)} withdrawals into {path}")
+
+_MISSING = object()
+
+class FrozenClaim(dict):
+    """The {"date": ...} value of a claim field as read from a UserRecord.
+    It is rebuilt on every read, so changing it in place would be silently
+    lost; it raises instead. Assign a new dict to the field."""
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Claim values read from a UserRecord are read-only; assign a new dict instead")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def copy(self):
+        return dict(self)
+
+    def __reduce__(self):
+        # copy.deepcopy and pickle give a plain dict back
+        return dict, (dict(self),)
+
+class UserRecord(MutableMapping):
+    """A user record with a slot per known field instead of a dict.
+
+    Behaves like the dict it replaces (handlers read and assign keys as
+    before, and dict(record) is the on-disk form), but the field names
+    aren't stored per user. Claim fields ({"date": "YYYY-MM-DD"}) are kept as
+    day ordinals and rebuilt on read as a read-only FrozenClaim; unknown keys
+    go to an overflow dict.
+    """
+
+    FIELDS = (
+        "verified_user", "completed_initial_tasks", "points", "total_earned", "total_withdrawn",
+        "referrals", "referral", "level", "level_version", "account_set", "bank_name", "account_number", "account_name",
+    )
+    CLAIMS = ("daily_bonus", "daily_tasks")
+    __slots__ = FIELDS + CLAIMS + ("_extra",)
+    _ORDER = FIELDS + CLAIMS
+    _SLOTS = frozenset(_ORDER)
+
+    def __init__(self, data=None):
+        self._extra = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    @classmethod
+    def from_mapping(cls, data):
+        """A new record holding a copy of ``data`` (a dict or a UserRecord)."""
+        if type(data) is cls:
+            return data.copy()
+        return cls(copy.deepcopy(data))
+
+    def copy(self):
+        record = UserRecord.__new__(UserRecord)
+        for name in self._ORDER:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                setattr(record, name, value)
+        record._extra = copy.deepcopy(self._extra) if self._extra is not None else None
+        return record
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __getitem__(self, key):
+        if key in self._SLOTS:
+            value = getattr(self, key, _MISSING)
+            if value is _MISSING:
+                raise KeyError(key)
+            if key in self.CLAIMS and type(value) is int:
+                return FrozenClaim(date=date.fromordinal(value).isoformat())
+            return value
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._SLOTS:
+            if key in self.CLAIMS and isinstance(value, dict) and len(value) == 1:
+                try:
+                    value = date.fromisoformat(value["date"]).toordinal()
+                except (KeyError, TypeError, ValueError):
+                    pass  # Kept as given
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._SLOTS:
+            if not hasattr(self, key):
+                raise KeyError(key)
+            delattr(self, key)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._SLOTS:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for name in self._ORDER:
+            if hasattr(self, name):
+                yield name
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"UserRecord({dict(self)!r})"
+
+class UserStore:
+    """Keeps user records in memory and writes changes back to the storage
+    backend in the background, so handlers never wait on the disk.
+
+    With ``stream`` the preloaded backend is read record by record in a
+    thread while the bot is already serving. Records are handed to the event
+    loop in batches; a user asked for before their batch arrives is looked up
+    in the file on demand. Records already in memory (looked up or updated)
+    win over the file's copy. Handlers prefetch() their users first so that
+    lookup (or, without preload, the database read) happens in a worker
+    thread rather than on the event loop. Without preload only ``cache_size``
+    records are kept, evicting the least recently used ones with no pending
+    changes.
+
+    Changes are tracked per backend shard, and each shard is flushed on its
+    own schedule (staggered across ``flush_interval``) under its own lock.
+    """
+
+    STREAM_BATCH = 5000
+
+    def __init__(self, backend, flush_interval=FLUSH_INTERVAL, stream=STREAM_LOAD, cache_size=USER_CACHE_SIZE):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.stream = stream and backend.preload and hasattr(backend, "stream_users")
+        self._users = {}
+        self._dirty = [set() for _ in range(backend.shards)]
+        self._loaded = False
+        self._flush_tasks = []
+        self._flush_locks = [asyncio.Lock() for _ in range(backend.shards)]
+        self._listeners = []
+        self._load_listeners = []
+        self.loading = False
+        self._batches = deque()
+        self._stream_done = threading.Event()
+        self._missing = OrderedDict()  # user id -> None, oldest first
+        self._absorb_task = None
+        self.load_error = None
+
+    def add_listener(self, listener):
+        """Call ``listener(user_id, old_info, new_info)`` on every update().
+        ``old_info`` is None for a new user."""
+        self._listeners.append(listener)
+
+    def add_load_listener(self, listener):
+        """Call ``listener(records)`` with each list of (user id, record) pairs
+        that arrives after load() has returned, i.e. while streaming."""
+        self._load_listeners.append(listener)
+
+    def load(self):
+        for dirty in self._dirty:
+            dirty.clear()
+        self._missing.clear()
+        self._loaded = True
+        self.load_error = None
+        if self.stream:
+            self._users = {}
+            self.loading = True
+            self._stream_done.clear()
+            threading.Thread(target=self._stream_users, name="user-loader", daemon=True).start()
+            return
+        users = {key: UserRecord(info) for key, info in self.backend.load_users().items()}
+        if self.backend.preload:
+            self._users = users
+            logger.info(f"Loaded {len(self._users)} users into memory")
+        else:
+            self._users = OrderedDict(users)
+
+    def _stream_users(self):
+        # Runs in the loader thread: parse only, the event loop owns self._users
+        started = time.perf_counter()
+        total = self.backend.data_size()
+        count, last_report = 0, started
+        batch = []
+        try:
+            for key, info, read in self.backend.stream_users():
+                batch.append((key, info))
+                count += 1
+                if len(batch) >= self.STREAM_BATCH:
+                    self._batches.append(batch)
+                    batch = []
+                    if time.perf_counter() - last_report >= 5:
+                        last_report = time.perf_counter()
+                        logger.info(f"Loading users: {count} so far ({read / max(total, 1):.0%} of user data)")
+        except Exception as e:
+            logger.error(f"Error loading data: {e}")
+            self.load_error = e
+        self._batches.append(batch)
+        logger.info(f"Read {count} users in {time.perf_counter() - started:.1f}s")
+        self._stream_done.set()
+
+    def _absorb(self):
+        """Move parsed batches into memory. Runs on the event loop."""
+        while self._batches:
+            fresh = []
+            for key, info in self._batches.popleft():
+                if key not in self._users:
+                    info = self._users[key] = UserRecord(info)
+                    fresh.append((key, info))
+            for listener in self._load_listeners:
+                listener(fresh)
+        if self.loading and self._stream_done.is_set() and not self._batches:
+            if self.load_error is not None:
+                # Stay in the loading state so every lookup keeps failing: a
+                # user missing from a partial store would be saved as new
+                raise RuntimeError("Loading user data failed") from self.load_error
+            self.loading = False
+            self._missing.clear()
+            logger.info(f"Loaded {len(self._users)} users into memory")
+
+    async def _absorb_loop(self):
+        try:
+            while self.loading:
+                await asyncio.sleep(0.05)
+                self._absorb()
+        except RuntimeError as e:
+            # Shut down the way an operator would, so pending changes are
+            # still flushed, and let main() exit with an error
+            logger.critical(f"{e}, stopping the bot")
+            signal.raise_signal(signal.SIGTERM)
+
+    async def wait_loaded(self):
+        while self.loading:
+            await asyncio.sleep(0.05)
+            self._absorb()
+
+    def _lookup(self, key):
+        if self.loading:
+            self._absorb()
+        info = self._users.get(key)
+        if info is not None and not self.backend.preload:
+            self._users.move_to_end(key)
+        if info is None and self.loading and key not in self._missing:
+            # Not read yet (or not in the file at all): fetch it directly
+            info = self._found(key, self.backend.find_user(key))
+        elif info is None and not self.backend.preload and key not in self._missing:
+            info = self._found(key, self.backend.get_user(key))
+        return info
+
+    def _found(self, key, info):
+        """Keep a record fetched on demand. One already in memory (absorbed or
+        updated while it was fetched) wins; a user the backend doesn't have
+        is remembered as missing until update() creates them."""
+        if key in self._users:
+            return self._users[key]
+        if info is None:
+            self._missing[key] = None
+            if len(self._missing) > self.cache_size:
+                self._missing.popitem(last=False)
+            return None
+        info = self._users[key] = UserRecord(info)
+        if not self.backend.preload:
+            self._evict()
+        if self.loading:
+            for listener in self._load_listeners:
+                listener([(key, info)])
+        return info
+
+    async def prefetch(self, *user_ids):
+        """Bring users into memory ahead of get(), reading the file or the
+        database in a worker thread instead of on the event loop. Does nothing
+        once a preloaded backend has finished loading."""
+        if not self._loaded:
+            self.load()
+        if self.backend.preload and not self.loading:
+            return
+        fetch = self.backend.find_user if self.loading else self.backend.get_user
+        for key in {str(user_id) for user_id in user_ids}:
+            if self.loading:
+                self._absorb()
+            if key not in self._users and key not in self._missing:
+                self._found(key, await asyncio.to_thread(fetch, key))
+
+    def get(self, user_id):
+        if not self._loaded:
+            self.load()
+        # Hand out a copy so handlers can mutate freely until they call update()
+        info = self._lookup(str(user_id))
+        return info.copy() if info is not None else UserRecord()
+
+    def update(self, user_id, user_info):
+        if not self._loaded:
+            self.load()
+        key = str(user_id)
+        if self._listeners:
+            old_info = self._lookup(key)
+            for listener in self._listeners:
+                listener(key, old_info, user_info)
+        self._users[key] = UserRecord.from_mapping(user_info)
+        self._missing.pop(key, None)
+        self._dirty[self.backend.shard_of(key)].add(key)
+        if not self.backend.preload:
+            self._users.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used records past ``cache_size``. Records
+        with unwritten changes, or in a shard being flushed, stay: the database
+        doesn't have their latest version yet."""
+        users = self._users
+        for _ in range(len(users)):
+            if len(users) <= self.cache_size:
+                break
+            key = next(iter(users))
+            shard = self.backend.shard_of(key)
+            if key in self._dirty[shard] or self._flush_locks[shard].locked():
+                users.move_to_end(key)
+            else:
+                del users[key]
+
+    async def iter_pages(self, after=None, page_size=500):
+        """Yield lists of up to ``page_size`` (user id, record) pairs in user id
+        order, starting after ``after``. Records are the stored ones: read only."""
+        if not self._loaded:
+            self.load()
+        if self.backend.preload:
+            await self.wait_loaded()
+            keys = sorted(self._users)
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            for i in range(start, len(keys), page_size):
+                page = [(key, self._users[key]) for key in keys[i:i + page_size]]
+                yield page
+        else:
+            # Write out pending changes so the database has every record
+            await self.flush()
+            while True:
+                page = await asyncio.to_thread(self.backend.users_page, after, page_size)
+                if not page:
+                    return
+                yield page
+                after = page[-1][0]
+
+    async def flush_shard(self, shard):
+        dirty = self._dirty[shard]
+        async with self._flush_locks[shard]:
+            if not dirty:
+                return
+            # Records are replaced, never mutated in place, so the writer
+            # thread can use them as they are.
+            records = {key: self._users[key] for key in dirty}
+            dirty.clear()
+            try:
+                await asyncio.to_thread(self.backend.write_users, records)
+            except Exception:
+                # Try them again on the next flush
+                dirty.update(records)
+                raise
+
+    async def flush_users(self, user_ids):
+        """Write the given users' pending changes now (with the rest of their
+        shards), for changes that must not wait for the next background flush."""
+        await self._flush_shards({self.backend.shard_of(str(user_id)) for user_id in user_ids})
+
+    async def flush(self):
+        await self._flush_shards(range(len(self._dirty)))
+
+    async def _flush_shards(self, shards):
+        results = await asyncio.gather(*(self.flush_shard(shard) for shard in shards), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    async def _flush_loop(self, shard):
+        await asyncio.sleep(self.flush_interval * shard / len(self._dirty))
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_shard(shard)
+            except Exception as e:
+                logger.error(f"Error flushing user data (shard {shard}): {e}")
+
+    def start(self):
+        if not self._loaded:
+            self.load()
+        if not self._flush_tasks:
+            self._flush_tasks = [asyncio.create_task(self._flush_loop(shard)) for shard in range(len(self._dirty))]
+        if self.loading and self._absorb_task is None:
+            self._absorb_task = asyncio.create_task(self._absorb_loop())
+
+    async def stop(self):
+        for task in self._flush_tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._flush_tasks = []
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing user data on shutdown: {e}")
+
+storage = SqliteBackend(SQLITE_FILE) if STORAGE_BACKEND == "sqlite" else JsonBackend()
+user_store = UserStore(storage)
+
+def get_user(user_id):
+    return user_store.get(user_id)
+
+def update_user(user_id, user_info):
+    user_store.update(user_id, user_info)
+
+def load_withdrawals():
+    return storage.load_withdrawals()
+
+def save_withdrawals(data):
+    storage.save_withdrawals(data)
+
+def add_withdrawal(withdrawal_id, withdrawal_data):
+    storage.add_withdrawal(withdrawal_id, withdrawal_data)
+
+def get_user_withdrawals(user_id):
+    return storage.get_user_withdrawals(user_id)
+
+def count_pending_withdrawals():
+    return storage.count_pending_withdrawals()
+
+def pending_withdrawals(offset, limit):
+    return storage.pending_withdrawals(offset, limit)
+
+def withdrawal_bank(withdrawal_data):
+    return (withdrawal_data.get("account_details") or {}).get("bank") or ""
+
+def export_withdrawals(status=None, start=None, end=None):
+    """Yield (id, record) of matching withdrawals grouped by bank, oldest
+    first within a bank. ``start``/``end`` are ISO dates, end exclusive."""
+    return storage.export_withdrawals(status, start, end)
+
+def set_withdrawal_status(withdrawal_ids, status, **fields):
+    """Move pending withdrawals to ``status`` in one storage write; returns the changed (id, record) pairs."""
+    return storage.set_withdrawal_status(withdrawal_ids, status, **fields)
+
+# --- Conversation State ---
+class ChatState(Enum):
+    """What the bot expects the user's next free-text message (or photo) to be."""
+    IDLE = "idle"
+    AWAITING_BANK = "awaiting_bank"
+    AWAITING_ACCOUNT_NUMBER = "awaiting_account_number"
+    AWAITING_ACCOUNT_NAME = "awaiting_account_name"
+    AWAITING_WITHDRAWAL_AMOUNT = "awaiting_withdrawal_amount"
+    AWAITING_TASK_PROOF = "awaiting_task_proof"
+
+    # Members are singletons compared by identity, so identity hashing is
+    # equivalent, and it runs in C instead of Enum's Python-level __hash__
+    __hash__ = object.__hash__
+
+# Flows started by menu buttons, which can be pressed at any point
+FLOW_STARTS = {ChatState.AWAITING_BANK, ChatState.AWAITING_WITHDRAWAL_AMOUNT, ChatState.AWAITING_TASK_PROOF}
+
+# Allowed state changes. Every state can also go back to IDLE or start a new flow.
+STATE_TRANSITIONS = {
+    state: {ChatState.IDLE} | FLOW_STARTS | extra
+    for state, extra in {
+        ChatState.IDLE: set(),
+        ChatState.AWAITING_BANK: {ChatState.AWAITING_ACCOUNT_NUMBER},
+        ChatState.AWAITING_ACCOUNT_NUMBER: {ChatState.AWAITING_ACCOUNT_NAME},
+        ChatState.AWAITING_ACCOUNT_NAME: set(),
+        ChatState.AWAITING_WITHDRAWAL_AMOUNT: set(),
+        ChatState.AWAITING_TASK_PROOF: set(),
+    }.items()
+}
+
+def get_state(context):
+    return context.user_data.get("state", ChatState.IDLE)
+
+def set_state(context, state):
+    current = get_state(context)
+    if state not in STATE_TRANSITIONS[current]:
+        logger.warning(f"Illegal state change {current.name} -> {state.name}, resetting to IDLE")
+        state = ChatState.IDLE
+    context.user_data["state"] = state
+
+# --- Leaderboard ---
+class Leaderboard:
+    """Users ranked by one numeric field, highest first. Entries live in a
+    SortedList, so updates, rank lookups and top-K are O(log n)."""
+
+    def __init__(self, field):
+        self.field = field
+        self._scores = {}  # user id -> score
+        self._ranked = SortedList()  # (-score, user id)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def update(self, user_id, score):
+        old_score = self._scores.get(user_id)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self._ranked.remove((-old_score, user_id))
+        self._scores[user_id] = score
+        self._ranked.add((-score, user_id))
+
+    def rank(self, user_id):
+        """1-based rank; users with equal scores share a rank."""
+        score = self._scores.get(str(user_id))
+        if score is None:
+            return None
+        return self._ranked.bisect_left((-score, "")) + 1
+
+    def top(self, k):
+        return [(user_id, -neg_score) for neg_score, user_id in self._ranked.islice(0, k)]
+
+leaderboards = {
+    "referrals": Leaderboard("referrals"),
+    "total_earned": Leaderboard("total_earned"),
+}
+
+def update_leaderboards(user_id, old_info, new_info):
+    for field, board in leaderboards.items():
+        score = new_info.get(field, 0)
+        if old_info is None or old_info.get(field, 0) != score or user_id not in board:
+            board.update(user_id, score)
+
+user_store.add_listener(update_leaderboards)
+
+def index_users(page):
+    """Add (user id, record) pairs to the leaderboards, level counts and claim index."""
+    for user_id, user_info in page:
+        for field, board in leaderboards.items():
+            board.update(user_id, user_info.get(field, 0))
+        claims.index(user_id, user_info)
+    level_engine.count(user_info for _, user_info in page)
+
+# Users that arrive during a streaming load are indexed as they come in
+user_store.add_load_listener(index_users)
+
+async def build_indexes():
+    """One pass over every user to seed the leaderboards, level counts and claim index."""
+    if user_store.loading:
+        return
+    async for page in user_store.iter_pages(page_size=5000):
+        index_users(page)
+    logger.info(f"Indexes built for {len(leaderboards['referrals'])} users")
+
+# --- Concurrency ---
+class KeyedLocks:
+    """One asyncio.Lock per key (user id), created on demand and dropped as
+    soon as nobody holds or waits for it."""
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders + waiters]
+
+    def __len__(self):
+        return len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *keys):
+        # Always lock in sorted order so two updates touching the same pair
+        # of users can't deadlock each other.
+        keys = sorted({str(key) for key in keys if key is not None})
+        entries = []
+        held = []
+        try:
+            for key in keys:
+                entry = self._locks.get(key)
+                if entry is None:
+                    entry = self._locks[key] = [asyncio.Lock(), 0]
+                entry[1] += 1
+                entries.append((key, entry))
+                await entry[0].acquire()
+                held.append(entry[0])
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.release()
+            for key, entry in entries:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+user_locks = KeyedLocks()
+
+def serialized(handler, extra_keys=None):
+    """Run ``handler`` while holding the lock of the user who sent the update
+    (plus any keys returned by ``extra_keys``), so concurrent updates for the
+    same user can't interleave their get_user/update_user calls. The sender's
+    own updates are already ordered by PerUserUpdateProcessor; the lock also
+    covers other users' records the handler touches (referrers, refunds)."""
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        keys = [update.effective_user.id] if update.effective_user else []
+        if extra_keys:
+            keys.extend(extra_keys(update, context))
+        async with user_locks.hold(*keys):
+            await user_store.prefetch(*keys)
+            return await handler(update, context)
+    return wrapper
+
+def referrer_lock_keys(update, context):
+    # /start <referrer_id> also credits the referrer's record
+    return context.args[:1] if context.args else []
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different users concurrently, up to
+    ``max_concurrent_updates`` at a time, and each user's updates one at a
+    time in arrival order.
+
+    An update waits for its user's earlier updates *before* taking one of
+    the concurrency slots, so a user tapping quickly (or waiting on a slow
+    API call) holds at most one slot instead of starving everyone else.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._users = KeyedLocks()
+        self._in_flight = 0
+
+    def __len__(self):
+        """Updates waiting for their turn or a slot, or being processed."""
+        return self._in_flight
+
+    async def process_update(self, update, coroutine):
+        # Replaces the base version, which takes the slot first and would
+        # hold it while queued behind the same user's other updates
+        user = update.effective_user if isinstance(update, Update) else None
+        self._in_flight += 1
+        try:
+            async with self._users.hold(user.id if user else None):
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            self._in_flight -= 1
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# --- Channel Membership Cache ---
+MEMBER_STATUSES = ("member", "administrator", "creator")
+
+class MembershipCache:
+    """LRU cache of channel membership keyed by user id, with separate TTLs
+    for positive and negative results. Concurrent lookups for the same user
+    share a single get_chat_member call."""
+
+    def __init__(self, ttl=MEMBERSHIP_TTL, negative_ttl=MEMBERSHIP_NEGATIVE_TTL, max_size=MEMBERSHIP_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # user_id -> (is_member, expires_at)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, user_id, is_member):
+        ttl = self.ttl if is_member else self.negative_ttl
+        self._entries[user_id] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _fetch(self, bot, user_id):
+        try:
+            member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
+            is_member = member.status in MEMBER_STATUSES
+        except BadRequest as e:
+            # "User not found" and friends: a definite answer, cache it as a miss
+            logger.info(f"Membership check for {user_id} failed: {e}")
+            is_member = False
+        self._store(user_id, is_member)
+        return is_member
+
+    async def is_member(self, bot, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(bot, user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        # shield: one impatient caller being cancelled mustn't cancel the others
+        return await asyncio.shield(task)
+
+membership_cache = MembershipCache()
+
+# --- Outbound Scheduler ---
+class Priority(IntEnum):
+    """Pass as ``rate_limit_args`` to a Bot method; lower values go first."""
+    REPLY = 0
+    ADMIN = 1
+    BROADCAST = 2
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+class OutboundScheduler(BaseRateLimiter):
+    """Rate limiter for every Bot API call that targets a chat.
+
+    Requests wait in one priority queue and a dispatcher task releases them
+    under a global token bucket plus one bucket per chat (or per group, at
+    the group rate). A request whose chat is over its limit is parked until
+    it has capacity, so it doesn't hold up other chats. On RetryAfter that
+    chat is paused for the time Telegram asks for and the request is queued
+    again.
+    """
+
+    MAX_IDLE_BUCKETS = 1024
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 group_rate=SEND_GROUP_RATE, max_retries=SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, max(1, global_rate))
+        self._buckets = {}
+        self._heap = []  # (priority, seq, enqueued_at, key, future)
+        self._seq = itertools.count()
+        self._parked = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.retries = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self._heap) + self._parked
+
+    @property
+    def wait_avg(self):
+        return self.wait_total / self.sent if self.sent else 0.0
+
+    async def initialize(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) > self.MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                for old_key, old_bucket in list(self._buckets.items()):
+                    if old_bucket.is_idle(now):
+                        del self._buckets[old_key]
+            is_group = (isinstance(key, int) and key < 0) or isinstance(key, str)
+            if is_group:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[key] = bucket
+        return bucket
+
+    def _push(self, entry):
+        heapq.heappush(self._heap, entry)
+        self._wakeup.set()
+
+    def _unpark(self, entry):
+        self._parked -= 1
+        self._push(entry)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            entry = heapq.heappop(self._heap)
+            priority, seq, enqueued_at, key, future = entry
+            if future.done():
+                continue  # caller gave up
+            now = time.monotonic()
+            bucket = self._bucket(key)
+            delay = bucket.delay(now)
+            if delay > 0:
+                self._parked += 1
+                loop.call_later(delay, self._unpark, entry)
+                continue
+            delay = self._global.delay(now)
+            if delay > 0:
+                heapq.heappush(self._heap, entry)
+                await asyncio.sleep(delay)
+                continue
+            bucket.take(now)
+            self._global.take(now)
+            waited = now - enqueued_at
+            SEND_WAIT.labels(Priority(priority).name.lower()).observe(waited)
+            self.sent += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            future.set_result(None)
+
+    async def _wait_turn(self, priority, key):
+        future = asyncio.get_running_loop().create_future()
+        self._push((priority, next(self._seq), time.monotonic(), key, future))
+        await future
+
+    @staticmethod
+    async def _call(endpoint, callback, args, kwargs):
+        if endpoint == "getUpdates":
+            # Long polling; its latency is mostly the poll timeout
+            return await callback(*args, **kwargs)
+        with API_LATENCY.labels(endpoint).time():
+            return await callback(*args, **kwargs)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or endpoint.startswith("get"):
+            return await self._call(endpoint, callback, args, kwargs)
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+        priority = Priority.REPLY if rate_limit_args is None else rate_limit_args
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(priority, chat_id)
+            try:
+                return await self._call(endpoint, callback, args, kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.info(f"Rate limited on {endpoint} to {chat_id}, retrying in {e.retry_after}s")
+                bucket = self._bucket(chat_id)
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + e.retry_after)
+
+outbound = OutboundScheduler()
+
+# --- Admin Notifications ---
+MAX_MESSAGE_LENGTH = 4096
+
+class AdminNotifier:
+    """Background queue of admin alerts. Handlers call notify() and move on;
+    a worker task coalesces queued alerts into digest messages."""
+
+    _STOP = object()
+
+    def __init__(self, max_items=ADMIN_DIGEST_MAX_ITEMS, interval=ADMIN_DIGEST_INTERVAL, max_retries=ADMIN_NOTIFY_MAX_RETRIES):
+        self.max_items = max_items
+        self.interval = interval
+        self.max_retries = max_retries
+        self.bot = None
+        self._queue = asyncio.Queue()
+        self._task = None
+        self._stopping = False
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def notify(self, text):
+        if ADMIN_CHAT_ID:
+            self._queue.put_nowait(text)
+
+    async def _collect(self):
+        item = await self._queue.get()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.interval
+        batch = []
+        while item is not self._STOP:
+            batch.append(item)
+            timeout = deadline - loop.time()
+            if len(batch) >= self.max_items or timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        else:
+            # stop() was called: close the digest window now
+            self._stopping = True
+        return batch
+
+    @staticmethod
+    def _format(batch):
+        if len(batch) == 1:
+            return batch
+        messages = []
+        current = f"📬 {len(batch)} new alerts:"
+        for item in batch:
+            if len(current) + len(item) + 2 > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = item
+            else:
+                current += "\n\n" + item
+        messages.append(current)
+        return messages
+
+    async def _send(self, text):
+        delay = 1
+        for _ in range(self.max_retries):
+            try:
+                await self.bot.send_message(chat_id=ADMIN_CHAT_ID, text=text, rate_limit_args=Priority.ADMIN)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.error(f"Error sending admin notification: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+        logger.error(f"Dropping admin notification after {self.max_retries} attempts")
+
+    async def _run(self):
+        while not self._stopping:
+            batch = await self._collect()
+            if batch:
+                for text in self._format(batch):
+                    await self._send(text)
+
+    def start(self, bot):
+        self.bot = bot
+        self._stopping = False
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Send the batch being collected and everything queued before it,
+        then end the worker."""
+        if self._task is None:
+            return
+        # Queued behind the pending alerts, so the worker reaches it only after them
+        self._queue.put_nowait(self._STOP)
+        try:
+            await self._task
+        except Exception as e:
+            logger.error(f"Error sending notifications on shutdown: {e}")
+        self._task = None
+
+admin_notifier = AdminNotifier()
+
+class WithdrawalNotifier(AdminNotifier):
+    """Tells users their withdrawals were approved or rejected. Changes are
+    collected like admin alerts and each user gets one message per batch."""
+
+    STATUS_TEXT = {
+        "approved": "✅ approved and is being paid out",
+        "rejected": "❌ rejected. The amount has been returned to your balance",
+    }
+
+    def __init__(self, max_items=100, interval=WITHDRAWAL_NOTICE_INTERVAL, max_retries=ADMIN_NOTIFY_MAX_RETRIES):
+        super().__init__(max_items, interval, max_retries)
+
+    def notify(self, withdrawal_data):
+        self._queue.put_nowait(withdrawal_data)
+
+    @classmethod
+    def _format(cls, batch):
+        by_user = {}
+        for w in batch:
+            by_user.setdefault(w["user_id"], []).append(
+                f"Your withdrawal of ₦{w['amount']:,.2f} was {cls.STATUS_TEXT.get(w['status'], w['status'])}."
+            )
+        return [(user_id, "\n\n".join(lines)) for user_id, lines in by_user.items()]
+
+    async def _send(self, item):
+        user_id, text = item
+        for _ in range(self.max_retries):
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text, rate_limit_args=Priority.BROADCAST)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except (Forbidden, BadRequest):
+                return  # Blocked the bot or deleted their account
+            except TelegramError as e:
+                logger.error(f"Error sending withdrawal notice to {user_id}: {e}")
+                await asyncio.sleep(1)
+        logger.error(f"Dropping withdrawal notice to {user_id} after {self.max_retries} attempts")
+
+withdrawal_notifier = WithdrawalNotifier()
+
+# --- Proof Intake ---
+def dhash(data, size=8):
+    """64-bit difference hash of an image: one bit per horizontally adjacent
+    pixel pair of a 9x8 grayscale thumbnail. Survives re-encoding, resizing
+    and small crops. Runs in a worker process."""
+    with Image.open(io.BytesIO(data)) as image:
+        pixels = list(image.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+class ProofHashIndex:
+    """Multi-index hash table of 64-bit perceptual hashes.
+
+    Each hash is split into four 16-bit chunks with one table per chunk. Two
+    hashes within distance d agree to within d // 4 bits on at least one
+    chunk, so a lookup only probes chunk values that close and checks the
+    full distance of those candidates. Entries are appended to a text file
+    and reloaded on startup.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self, path=PROOF_HASH_FILE, max_distance=PROOF_DUPLICATE_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self._hashes = []
+        self._owners = []  # (user_id, proof_id) per entry
+        self._tables = [{} for _ in range(self.CHUNKS)]
+        self._lock = threading.Lock()
+        self._mask = (1 << self.CHUNK_BITS) - 1
+        radius = max_distance // self.CHUNKS
+        # XOR masks for every chunk value within `radius` bits
+        self._flips = [
+            sum(1 << bit for bit in bits)
+            for r in range(radius + 1) for bits in itertools.combinations(range(self.CHUNK_BITS), r)
+        ]
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _chunks(self, value):
+        return [(value >> (i * self.CHUNK_BITS)) & self._mask for i in range(self.CHUNKS)]
+
+    def _insert(self, value, user_id, proof_id):
+        entry = len(self._hashes)
+        self._hashes.append(value)
+        self._owners.append((user_id, proof_id))
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(entry)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with self._lock, open(self.path, "r") as f:
+            for line in f:
+                try:
+                    value, user_id, proof_id = line.split()
+                    self._insert(int(value, 16), user_id, proof_id)
+                except ValueError:
+                    logger.error(f"Skipping bad proof hash line: {line!r}")
+        logger.info(f"Loaded {len(self._hashes)} proof hashes from {self.path}")
+
+    def _find(self, value):
+        candidates = set()
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for flip in self._flips:
+                bucket = table.get(chunk ^ flip)
+                if bucket:
+                    candidates.update(bucket)
+        hashes, max_distance = self._hashes, self.max_distance
+        return sorted(
+            (distance, *self._owners[entry])
+            for entry in candidates
+            if (distance := (hashes[entry] ^ value).bit_count()) <= max_distance
+        )
+
+    def find(self, value):
+        """Earlier proofs within max_distance, as (distance, user_id, proof_id), closest first."""
+        with self._lock:
+            return self._find(value)
+
+    def match_and_add(self, value, user_id, proof_id):
+        """Look up ``value`` and then record it, as one step."""
+        with self._lock:
+            matches = self._find(value)
+            self._insert(value, user_id, proof_id)
+            with open(self.path, "a") as f:
+                f.write(f"{value:016x} {user_id} {proof_id}\n")
+        return matches
+
+class ProofPipeline:
+    """Queue of submitted task screenshots. The handler only enqueues the
+    file_id; workers download the largest size, store it under PROOF_DIR by
+    SHA-256, hash it perceptually to flag reused screenshots and append a
+    pending-review entry to the proof log."""
+
+    def __init__(self, directory=PROOF_DIR, log_path=PROOF_LOG, workers=PROOF_WORKERS, max_retries=PROOF_MAX_RETRIES):
+        self.directory = directory
+        self.log = RecordLog(log_path, "proof")
+        self.workers = workers
+        self.max_retries = max_retries
+        self.bot = None
+        self.stored = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.hashes = ProofHashIndex()
+        self._hash_pool = None
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def submit(self, user_id, file_id):
+        self._queue.put_nowait((str(user_id), file_id, datetime.now().isoformat()))
+
+    def _store(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, digest[:2], f"{digest}.jpg")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        STORAGE_BYTES.labels("store_proof").inc(len(data))
+        return digest, path
+
+    async def _download(self, file_id):
+        delay = 1
+        for attempt in range(self.max_retries):
+            try:
+                file = await self.bot.get_file(file_id)
+                return bytes(await file.download_as_bytearray())
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.error(f"Error downloading proof {file_id}: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+        return None
+
+    async def _check_duplicate(self, proof_id, user_id, data):
+        loop = asyncio.get_running_loop()
+        try:
+            value = await loop.run_in_executor(self._hash_pool, dhash, data)
+        except Exception as e:
+            logger.error(f"Error hashing proof {proof_id}: {e}")
+            return None, []
+        matches = await asyncio.to_thread(self.hashes.match_and_add, value, user_id, proof_id)
+        if matches:
+            self.duplicates += 1
+            others = {match_user for _, match_user, _ in matches if match_user != user_id}
+            admin_notifier.notify(
+                f"⚠️ Possible reused proof from user {user_id}\n"
+                f"Matches {len(matches)} earlier proof(s), closest {matches[0][0]} bits apart\n"
+                + (f"Also sent by: {', '.join(sorted(others)[:5])}" if others else "Sent by the same user before")
+            )
+        return f"{value:016x}", [proof for _, _, proof in matches[:10]]
+
+    async def _process(self, user_id, file_id, submitted_at):
+        proof_id = f"{datetime.now().timestamp()}.{user_id}"
+        record = {"user_id": user_id, "date": submitted_at, "file_id": file_id, "status": "pending"}
+        data = await self._download(file_id)
+        if data is None:
+            # Keep the entry so it can still be reviewed from the file_id
+            self.failed += 1
+            record.update(sha256=None, path=None)
+        else:
+            digest, path = await asyncio.to_thread(self._store, data)
+            self.stored += 1
+            record.update(sha256=digest, path=path)
+            phash, duplicate_of = await self._check_duplicate(proof_id, user_id, data)
+            record["phash"] = phash
+            if duplicate_of:
+                record["duplicate_of"] = duplicate_of
+        await asyncio.to_thread(self.log.append, proof_id, record)
+
+    async def _run(self):
+        while True:
+            user_id, file_id, submitted_at = await self._queue.get()
+            try:
+                await self._process(user_id, file_id, submitted_at)
+            except Exception as e:
+                logger.error(f"Error processing proof {file_id} from {user_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def start(self, bot):
+        self.bot = bot
+        if self._hash_pool is None:
+            # Not fork: the bot's threads (loaders, compactors, the webhook
+            # server) may hold locks that a forked child would inherit held
+            self._hash_pool = ProcessPoolExecutor(
+                max_workers=PROOF_HASH_PROCESSES, mp_context=multiprocessing.get_context("forkserver")
+            )
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=PROOF_DRAIN_TIMEOUT):
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # file_ids stay valid on Telegram's side, so these can be fetched later
+        while not self._queue.empty():
+            user_id, file_id, submitted_at = self._queue.get_nowait()
+            logger.error(f"Proof not downloaded before shutdown: user {user_id} file_id {file_id} at {submitted_at}")
+        if self._hash_pool is not None:
+            self._hash_pool.shutdown()
+            self._hash_pool = None
+
+proof_pipeline = ProofPipeline()
+
+def is_admin(update):
+    return bool(ADMIN_CHAT_ID) and str(update.effective_user.id) == str(ADMIN_CHAT_ID)
+
+# --- Daily Claims ---
+CLAIM_FIELDS = ("daily_bonus", "daily_tasks")
+
+class ClaimIndex:
+    """Set of user ids per claim type per day.
+
+    The current day (shifted by DAY_BOUNDARY_HOUR) is computed once and
+    reused until the next boundary passes. Days older than the retention
+    window are dropped then. Claim dates are also stored on the user record
+    (``user_info[field]["date"]``), and the index is rebuilt from them at
+    startup.
+    """
+
+    def __init__(self, boundary_hour=DAY_BOUNDARY_HOUR, retention_days=CLAIM_RETENTION_DAYS):
+        self.boundary = timedelta(hours=boundary_hour)
+        self.retention_days = retention_days
+        self._days = {field: {} for field in CLAIM_FIELDS}  # field -> {day: set of user ids}
+        self._today = None
+        self._oldest = None
+        self._next_boundary = 0.0
+
+    def _roll(self, now):
+        day = (datetime.fromtimestamp(now, timezone.utc) - self.boundary).date()
+        self._today = day.isoformat()
+        self._oldest = (day - timedelta(days=self.retention_days - 1)).isoformat()
+        start_of_day = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + self.boundary
+        self._next_boundary = (start_of_day + timedelta(days=1)).timestamp()
+        for days in self._days.values():
+            for old_day in [d for d in days if d < self._oldest]:
+                del days[old_day]
+
+    def today(self):
+        now = time.time()
+        if now >= self._next_boundary:
+            self._roll(now)
+        return self._today
+
+    def has_claimed(self, field, user_id):
+        return str(user_id) in self._days[field].get(self.today(), ())
+
+    def mark(self, field, user_id, day=None):
+        day = day or self.today()
+        if day >= self._oldest:
+            self._days[field].setdefault(day, set()).add(str(user_id))
+
+    def count(self, field, day=None):
+        return len(self._days[field].get(day or self.today(), ()))
+
+    def index(self, user_id, user_info):
+        self.today()
+        for field in CLAIM_FIELDS:
+            day = (user_info.get(field) or {}).get("date")
+            if day:
+                self.mark(field, user_id, day)
+
+claims = ClaimIndex()
+
+def has_claimed_today(user_id, field):
+    return claims.has_claimed(field, user_id)
+
+def mark_claimed_today(user_id, user_info, field):
+    today = claims.today()
+    user_info[field] = {"date": today}
+    claims.mark(field, user_id, today)
+
+# --- Levels ---
+class LevelEngine:
+    """Evaluates LEVEL_TIERS and keeps the level cached on each user record.
+
+    Thresholds rise with every tier, so a user's tier is the lower of the
+    tier reached by referrals and the tier reached by earnings, found with
+    two bisects. The computed level is stored as ``user_info["level"]``,
+    alongside a fingerprint of the tier table in ``user_info["level_version"]``,
+    and is only recomputed when referrals or total_earned change or the tiers
+    have changed since. A level distribution is kept up to date, and
+    listeners are told about level changes.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = sorted((tuple(tier) for tier in tiers), key=lambda tier: tier[1])
+        self._min_referrals = [tier[2] for tier in self.tiers]
+        self._min_earned = [tier[3] for tier in self.tiers]
+        if self._min_referrals != sorted(self._min_referrals) or self._min_earned != sorted(self._min_earned):
+            raise ValueError("Level tier thresholds must increase with the level")
+        if self._min_referrals[0] != 0 or self._min_earned[0] != 0:
+            raise ValueError("The first level tier must start at 0 referrals and 0 earned")
+        self.version = zlib.crc32(json.dumps(self.tiers).encode())
+        self.distribution = Counter()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Call ``listener(user_id, old_level, new_level)`` when a known user's level changes."""
+        self._listeners.append(listener)
+
+    def _tier_index(self, referrals, total_earned):
+        return min(
+            bisect.bisect_right(self._min_referrals, referrals),
+            bisect.bisect_right(self._min_earned, total_earned)
+        ) - 1
+
+    def evaluate(self, user_info):
+        tier = self.tiers[self._tier_index(user_info.get("referrals", 0), user_info.get("total_earned", 0))]
+        return (tier[0], tier[1])
+
+    def evaluate_many(self, user_infos):
+        """Levels for a batch of records."""
+        tier_index = self._tier_index
+        tiers = self.tiers
+        return [
+            tiers[tier_index(user_info.get("referrals", 0), user_info.get("total_earned", 0))][1]
+            for user_info in user_infos
+        ]
+
+    def level_of(self, user_info):
+        """The cached level if the record has one for the current tiers, else a fresh evaluation."""
+        level_num = user_info.get("level")
+        if level_num is None or user_info.get("level_version") != self.version:
+            return self.evaluate(user_info)[1]
+        return level_num
+
+    def name_of(self, level_num):
+        for tier in self.tiers:
+            if tier[1] == level_num:
+                return tier[0]
+        return self.tiers[0][0]
+
+    def next_tier(self, level_num):
+        for tier in self.tiers:
+            if tier[1] > level_num:
+                return tier
+        return None
+
+    def count(self, user_infos):
+        self.distribution.update(self.evaluate_many(user_infos))
+
+    def on_user_update(self, user_id, old_info, new_info):
+        if (
+            old_info is not None
+            and "level" in new_info
+            and new_info.get("level_version") == self.version
+            and old_info.get("referrals", 0) == new_info.get("referrals", 0)
+            and old_info.get("total_earned", 0) == new_info.get("total_earned", 0)
+        ):
+            return
+        new_level = self.evaluate(new_info)[1]
+        new_info["level"] = new_level
+        new_info["level_version"] = self.version
+        # Evaluated like count() did when seeding the distribution, not read
+        # from the cache, so the counts can't drift
+        old_level = self.evaluate(old_info)[1] if old_info is not None else None
+        if old_level == new_level:
+            return
+        if old_level is not None:
+            self.distribution[old_level] -= 1
+        self.distribution[new_level] += 1
+        if old_level is not None:
+            for listener in self._listeners:
+                listener(user_id, old_level, new_level)
+
+level_engine = LevelEngine(LEVEL_TIERS)
+user_store.add_listener(level_engine.on_user_update)
+
+def calculate_level(user_data):
+    return level_engine.evaluate(user_data)
+
+async def announce_level_change(bot, user_id, old_level, new_level):
+    if new_level <= old_level:
+        return
+    try:
+        await bot.send_message(
+            chat_id=int(user_id),
+            text=f"🎉 Level up! You're now {level_engine.name_of(new_level)} (Level {new_level}).",
+            reply_markup=get_main_menu_keyboard()
+        )
+    except TelegramError as e:
+        logger.info(f"Could not announce level change to {user_id}: {e}")
+
+# --- Keyboards & Templates ---
+class Templates:
+    """Keyboards and message text that depend only on config, built once at
+    startup and shared by every reply. Telegram objects are immutable, so
+    sharing them between concurrent handlers is safe."""
+
+    def __init__(self):
+        self.main_menu = ReplyKeyboardMarkup(
+            [
+                ["💰 Balance", "📝 Tasks"],
+                ["🏦 Set Account", "👥 Referral"],
+                ["💳 Withdraw", "📋 Withdrawals"],
+                ["🏆 Level", "🎁 Daily Bonus"],
+                ["🏠 Main Menu"]
+            ],
+            resize_keyboard=True,
+            one_time_keyboard=False
+        )
+        self.back_to_menu = ReplyKeyboardMarkup(
+            [["🏠 Main Menu"]],
+            resize_keyboard=True
+        )
+
+        channel = (CHANNEL_USERNAME or "").lstrip('@')
+        self.start_tasks = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🐦 Follow Twitter", url=f"https://twitter.com/{TWITTER_HANDLE}")],
+            [InlineKeyboardButton("💬 Join Whatsapp Group", url="https://chat.whatsapp.com/KyBPEZKLjAZ8JMgFt9KMft")],
+            [InlineKeyboardButton("📢 Join Whatsapp Channel", url="https://whatsapp.com/channel/0029VbAXEgUFy72Ich07Z53o")],
+            [InlineKeyboardButton("💬 Wanna Stream And Earn ?", url="https://chat.whatsapp.com/JdhB8efTVAOGZzFKoS9S4d")],
+            [InlineKeyboardButton("✅ Join Telegram Channel", url=f"https://t.me/{channel}")],
+            [InlineKeyboardButton("🔍 Verify Tasks", callback_data="verify_tasks")]
+        ])
+        self.confirm_twitter = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("✅ I've Followed on Twitter", callback_data="confirm_twitter")]]
+        )
+
+        bot_link = f"https://t.me/{BOT_USERNAME}"
+        task_link1 = f"https://twitter.com/{TWITTER_HANDLE}"
+        post_text = f"I just joined the Utilizers, and you should too! \n\nGet started early and don't miss out. \n\nAct fast, and accumulate earnings!\n\n{bot_link}"
+        encoded_text = urllib.parse.quote(post_text)
+        task_link2 = f"https://twitter.com/intent/tweet?text={encoded_text}"
+        task_link3 = f"https://wa.me/?text={encoded_text}"
+        task_link4 = "https://chat.whatsapp.com/JdhB8efTVAOGZzFKoS9S4d"
+        self.tasks_html = (
+            f"📝 Available Tasks (Complete all to earn ₦50 daily):\n\n"
+            f"1. Follow <a href='{task_link1}'>Utilizer01 on Twitter</a>\n\n"
+            f"2. <a href='{task_link2}'>Post on X (Twitter)</a>\n\n"
+            f"3. <a href='{task_link3}'>Share to 5 WhatsApp groups and your status</a>\n\n"
+            f"4. <a href='{task_link4}'>Wanna stream your fav music and earn ? Join here</a>\n\n"
+            "After completing all tasks, upload screenshots as proof to claim your ₦50 reward."
+        )
+
+        self.referral_link_prefix = f"https://t.me/{BOT_USERNAME}?start="
+
+templates = Templates()
+
+def get_main_menu_keyboard():
+    return templates.main_menu
+
+# --- Start Command ---
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    user_data = get_user(user.id)
+
+    if "referral" not in user_data:
+        if context.args:
+            referrer_id = context.args[0]
+            if referrer_id != str(user.id):
+                referrer_data = get_user(referrer_id)
+                referrer_data["points"] = referrer_data.get("points", 0) + 70
+                referrer_data["total_earned"] = user_data.get("total_earned", 0) + 70
+                referrer_data["referrals"] = referrer_data.get("referrals", 0) + 1
+                update_user(referrer_id, referrer_data)
+                user_data["referral"] = referrer_id
+                await update.message.reply_text(
+                    "🎯 You just referred a user and got 25 Points...",
+                    reply_markup=get_main_menu_keyboard()
+                )
+
+    update_user(user.id, user_data)
+
+    await update.message.reply_text(
+        f"🎯 WELCOME {user.username or user.first_name} \n\nTo participate in the campaign, complete the tasks below:\n\n\n"
+        "Click the Verify Tasks button below to verify!",
+        reply_markup=templates.start_tasks
+    )
+
+async def verify_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+
+    try:
+        if not await membership_cache.is_member(context.bot, user_id):
+            raise Exception("Not joined")
+    except Exception as e:
+        logger.error(f"Error verifying channel membership: {e}")
+        await query.edit_message_text("❌ You have not joined the Telegram channel.\n\nType or tap /start to start again")
+        return
+
+    await query.edit_message_text(
+        "👀 We can't verify Twitter follows automatically.\n\n"
+        "Click the button below after you've followed us.",
+        reply_markup=templates.confirm_twitter
+    )
+
+async def confirm_twitter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    user_data = get_user(user_id)
+    
+    # Mark tasks as completed
+    user_data["completed_initial_tasks"] = True
+    user_data["verified_user"] = True
+    user_data["points"] = user_data.get("points", 0) + 50  # 50 Naira for completing tasks
+    user_data["total_earned"] = user_data.get("total_earned", 0) + 50
+    
+    update_user(user_id, user_data)
+
+    await query.edit_message_text(
+        "✅ You're verified and have earned ₦50 for completing the tasks!\n\n"
+        "Use the menu below to explore the bot features:",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+# --- Command Handlers ---
+async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    if not user_data.get("verified_user"):
+        await update.message.reply_text("❌ Please complete verification first using /start")
+        return
+    
+    handler = resolve_route(update.message.text, get_state(context))
+    await handler(update, context)
+
+async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    set_state(context, ChatState.IDLE)
+    await update.message.reply_text(
+        "Main Menu:",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "I didn't understand that command. Please use the menu buttons.",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    balance_naira = user_data.get("points", 0) * POINTS_TO_NAIRA
+    await update.message.reply_text(
+        f"💰 Your current balance: ₦{balance_naira:,.2f}",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+#tasks
+async def tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    # Check if user has already claimed today
+    if has_claimed_today(user_id, "daily_tasks"):
+        await update.message.reply_text(
+            "❌ You've already completed tasks today. Come back tomorrow!",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    await update.message.reply_text(
+        templates.tasks_html, 
+        parse_mode=ParseMode.HTML,
+        reply_markup=get_main_menu_keyboard()
+    )
+    set_state(context, ChatState.AWAITING_TASK_PROOF)
+
+async def handle_task_proof(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if get_state(context) is not ChatState.AWAITING_TASK_PROOF:
+        return
+    
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    # Check if user has already claimed today
+    if has_claimed_today(user_id, "daily_tasks"):
+        await update.message.reply_text(
+            "❌ You've already claimed your daily task reward today. Come back tomorrow!",
+            reply_markup=get_main_menu_keyboard()
+        )
+        set_state(context, ChatState.IDLE)
+        return
+    
+    # Award the user; the screenshot itself is fetched and filed in the background
+    proof_pipeline.submit(user_id, update.message.photo[-1].file_id)
+    user_data["points"] = user_data.get("points", 0) + 50
+    user_data["total_earned"] = user_data.get("total_earned", 0) + 50
+    mark_claimed_today(user_id, user_data, "daily_tasks")
+    update_user(user_id, user_data)
+    
+    await update.message.reply_text(
+        "✅ Screenshot received! You've been awarded ₦50 for completing today's tasks.",
+        reply_markup=get_main_menu_keyboard()
+    )
+    set_state(context, ChatState.IDLE)
+
+
+async def set_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    # Check if user already has account details
+    if user_data.get("account_set"):
+        await update.message.reply_text(
+            f"Your current account details:\n"
+            f"Bank: {user_data.get('bank_name', 'Not set')}\n"
+            f"Account Number: {user_data.get('account_number', 'Not set')}\n"
+            f"Account Name: {user_data.get('account_name', 'Not set')}\n\n"
+            "To update, please send:\n"
+            "1. Your bank (OPay or PalmPay)\n"
+            "2. Your account number\n"
+            "3. Your account name\n\n"
+            "In separate messages.",
+            reply_markup=templates.back_to_menu
+        )
+        set_state(context, ChatState.AWAITING_BANK)
+        return
+    
+    await update.message.reply_text(
+        "Please set your account details by sending:\n"
+        "Your bank (OPay or PalmPay)\n",
+        reply_markup=templates.back_to_menu
+    )
+    set_state(context, ChatState.AWAITING_BANK)
+
+async def handle_bank_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    bank = update.message.text.strip().lower()
+    
+    if bank not in ["opay", "palmpay"]:
+        await update.message.reply_text(
+            "❌ Invalid bank. Please choose either OPay or PalmPay.",
+            reply_markup=templates.back_to_menu
+        )
+        return
+    
+    context.user_data["selected_bank"] = bank.capitalize()
+    set_state(context, ChatState.AWAITING_ACCOUNT_NUMBER)
+    
+    await update.message.reply_text(
+        "Now please send your account number:",
+        reply_markup=templates.back_to_menu
+    )
+
+async def handle_account_number(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    account_number = update.message.text.strip()
+    
+    if not account_number.isdigit() or len(account_number) < 10:
+        await update.message.reply_text(
+            "❌ Invalid account number. Please enter a valid 10-digit account number.",
+            reply_markup=templates.back_to_menu
+        )
+        return
+    
+    context.user_data["account_number"] = account_number
+    set_state(context, ChatState.AWAITING_ACCOUNT_NAME)
+    
+    await update.message.reply_text(
+        "Now please send your account name as it appears on your bank records:",
+        reply_markup=templates.back_to_menu
+    )
+
+async def handle_account_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    account_name = update.message.text.strip()
+    
+    if len(account_name) < 2:
+        await update.message.reply_text(
+            "❌ Invalid account name. Please enter your full name.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    # Save all account details
+    user_data = get_user(user_id)
+    user_data["bank_name"] = context.user_data.pop("selected_bank")
+    user_data["account_number"] = context.user_data.pop("account_number")
+    user_data["account_name"] = account_name
+    user_data["account_set"] = True
+    update_user(user_id, user_data)
+    
+    set_state(context, ChatState.IDLE)
+    
+    await update.message.reply_text(
+        f"✅ Account details saved successfully!\n\n"
+        f"Bank: {user_data['bank_name']}\n"
+        f"Account Number: {user_data['account_number']}\n"
+        f"Account Name: {user_data['account_name']}",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+async def referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    ref_link = f"{templates.referral_link_prefix}{user_id}"
+    count = user_data.get("referrals", 0)
+    await update.message.reply_text(
+        f"👥 Your referral link:\n{ref_link}\n\n"
+        f"Total referrals: {count}\n"
+        f"Earn ₦70 for each successful referral (when they complete initial tasks)",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+async def withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    if not user_data.get("account_set"):
+        await update.message.reply_text(
+            "❌ Please set your account details first using '🏦 Set Account'",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    balance_naira = user_data.get("points", 0) * POINTS_TO_NAIRA
+    
+    if balance_naira < 1000:
+        await update.message.reply_text(
+            f"❌ Minimum withdrawal is ₦1,000. Your current balance is ₦{balance_naira:,.2f}",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    await update.message.reply_text(
+        f"💰 Your current balance: ₦{balance_naira:,.2f}\n"
+        f"Minimum withdrawal: ₦1,000\n\n"
+        "Please enter the amount you want to withdraw:",
+        reply_markup=templates.back_to_menu
+    )
+    set_state(context, ChatState.AWAITING_WITHDRAWAL_AMOUNT)
+
+async def handle_withdrawal_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    amount_text = update.message.text.strip()
+    
+    try:
+        amount = float(amount_text)
+        if amount < 1000:
+            await update.message.reply_text(
+                "❌ Minimum withdrawal is ₦1,000",
+                reply_markup=get_main_menu_keyboard()
+            )
+            return
+        
+        user_data = get_user(user_id)
+        balance_naira = user_data.get("points", 0) * POINTS_TO_NAIRA
+        
+        if amount > balance_naira:
+            await update.message.reply_text(
+                f"❌ Insufficient balance. Your current balance is ₦{balance_naira:,.2f}",
+                reply_markup=get_main_menu_keyboard()
+            )
+            return
+        
+        # Process withdrawal
+        withdrawal_id = str(datetime.now().timestamp())
+        withdrawal_data = {
+            "user_id": str(user_id),
+            "amount": amount,
+            "status": "pending",
+            "date": datetime.utcnow().isoformat(),
+            "account_details": {
+                "bank": user_data.get("bank_name"),
+                "account_number": user_data.get("account_number"),
+                "account_name": user_data.get("account_name")
+            }
+        }
+        
+        # Save withdrawal record
+        await asyncio.to_thread(add_withdrawal, withdrawal_id, withdrawal_data)
+        
+        # Deduct from user balance
+        user_data["points"] = max(0, user_data.get("points", 0) - (amount / POINTS_TO_NAIRA))
+        user_data["total_withdrawn"] = user_data.get("total_withdrawn", 0) + amount
+        user_data["total_earned"] = user_data.get("total_earned", 0) + amount
+        update_user(user_id, user_data)
+        # The withdrawal is already in the log: make the deduction durable too
+        # before confirming, or a crash would leave the balance to withdraw again
+        await user_store.flush_users([user_id])
+        
+        # Notify admin (queued, sent as part of the next digest)
+        admin_notifier.notify(
+            f"🔄 New Withdrawal Request:\n\n"
+            f"User: @{update.effective_user.username or update.effective_user.first_name}\n"
+            f"User ID: {user_id}\n"
+            f"Amount: ₦{amount:,.2f}\n"
+            f"Bank: {user_data.get('bank_name')}\n"
+            f"Account Number: {user_data.get('account_number')}\n"
+            f"Account Name: {user_data.get('account_name')}\n\n"
+            f"Withdrawal ID: {withdrawal_id}"
+        )
+        
+        await update.message.reply_text(
+            f"✅ Withdrawal request of ₦{amount:,.2f} submitted successfully!\n\n"
+            "Your request will be processed within 24 hours.\n"
+            "Use '📋 Withdrawals' to check your withdrawal history.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        
+        set_state(context, ChatState.IDLE)
+    
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Invalid amount. Please enter a valid number.",
+            reply_markup=get_main_menu_keyboard()
+        )
+
+async def withdrawals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    user_withdrawals = await asyncio.to_thread(get_user_withdrawals, user_id)
+    
+    if not user_withdrawals:
+        await update.message.reply_text(
+            "You have no withdrawal records yet.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    total_withdrawn = user_data.get("total_withdrawn", 0)
+    total_earned = user_data.get("total_earned", 0)
+    
+    message = "📝 Your Withdrawal History:\n\n"
+    for w in user_withdrawals:
+        try:
+            date = datetime.fromisoformat(w["date"]).strftime("%Y-%m-%d %H:%M")
+            message += (
+                f"💰 Amount: ₦{w['amount']:,.2f}\n"
+                f"📅 Date: {date}\n"
+                f"🔄 Status: {w.get('status', 'pending')}\n"
+                f"🏦 Bank: {w['account_details']['bank']}\n"
+                f"🔢 Account: {w['account_details']['account_number']}\n\n"
+            )
+        except Exception as e:
+            logger.error(f"Error formatting withdrawal record: {e}")
+            continue
+    
+    message += f"💵 Total Withdrawn: ₦{total_withdrawn:,.2f}\n"
+    message += f"💸 Total Earned: ₦{total_earned:,.2f}"
+    
+    await update.message.reply_text(
+        message,
+        reply_markup=get_main_menu_keyboard()
+    )
+
+async def level(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    level_num = level_engine.level_of(user_data)
+    level_name = level_engine.name_of(level_num)
+    referrals = user_data.get("referrals", 0)
+    total_earned = user_data.get("total_earned", 0)
+    
+    message = (
+        f"🏆 Your Level: {level_name} (Level {level_num})\n\n"
+        f"👥 Referrals: {referrals}\n"
+        f"💰 Total Earned: ₦{total_earned:,.2f}\n\n"
+    )
+    
+    total_users = len(leaderboards["referrals"])
+    referral_rank = leaderboards["referrals"].rank(user_id)
+    earnings_rank = leaderboards["total_earned"].rank(user_id)
+    if referral_rank and earnings_rank:
+        message += (
+            f"📊 Referral Rank: #{referral_rank:,} of {total_users:,}\n"
+            f"📊 Earnings Rank: #{earnings_rank:,} of {total_users:,}\n\n"
+        )
+    
+    # Show next level requirements
+    next_tier = level_engine.next_tier(level_num)
+    if next_tier:
+        next_name, _, min_referrals, min_earned = next_tier
+        message += f"Next Level ({next_name}) Requirements:\n- {min_referrals} referrals\n- ₦{min_earned:,} total earned"
+    else:
+        message += "You've reached the highest level!"
+    
+    await update.message.reply_text(
+        message,
+        reply_markup=get_main_menu_keyboard()
+    )
+
+async def daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = get_user(user_id)
+    
+    if has_claimed_today(user_id, "daily_bonus"):
+        await update.message.reply_text(
+            "❌ You've already claimed your daily bonus today. Come back tomorrow!",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    # Award daily bonus
+    user_data["points"] = user_data.get("points", 0) + DAILY_BONUS_AMOUNT
+    user_data["total_earned"] = user_data.get("total_earned", 0) + DAILY_BONUS_AMOUNT
+    mark_claimed_today(user_id, user_data, "daily_bonus")
+    update_user(user_id, user_data)
+    
+    await update.message.reply_text(
+        f"🎁 You've claimed your daily bonus of ₦{DAILY_BONUS_AMOUNT}!\n"
+        f"💰 Your new balance: ₦{(user_data.get('points', 0) * POINTS_TO_NAIRA):,.2f}",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+# --- Routing ---
+# Menu buttons, keyed by normalized label. These win over any pending input.
+MENU_ROUTES = {
+    "💰 balance": balance,
+    "📝 tasks": tasks,
+    "🏦 set account": set_account,
+    "👥 referral": referral,
+    "💳 withdraw": withdraw,
+    "📋 withdrawals": withdrawals,
+    "🏆 level": level,
+    "🎁 daily bonus": daily_bonus,
+    "🏠 main menu": main_menu,
+}
+
+# Free text that isn't a menu button goes to whatever the current state expects
+STATE_ROUTES = {
+    ChatState.AWAITING_BANK: handle_bank_selection,
+    ChatState.AWAITING_ACCOUNT_NUMBER: handle_account_number,
+    ChatState.AWAITING_ACCOUNT_NAME: handle_account_name,
+    ChatState.AWAITING_WITHDRAWAL_AMOUNT: handle_withdrawal_amount,
+}
+
+# The exact labels the main menu keyboard sends, so button presses (most
+# messages) skip normalizing
+MENU_LABELS = {
+    button.text: MENU_ROUTES[button.text.strip().lower()]
+    for row in templates.main_menu.keyboard for button in row
+}
+
+def resolve_route(text, state):
+    handler = MENU_LABELS.get(text)
+    if handler is None:
+        # Typed labels are normalized with strip().lower(), inlined here as it's the hot path
+        handler = MENU_ROUTES.get(text.strip().lower())
+        if handler is None:
+            handler = STATE_ROUTES.get(state, unknown_command)
+    return handler
+
+async def top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+
+    def board_lines(board, fmt):
+        lines = []
+        for position, (entry_id, score) in enumerate(board.top(10), start=1):
+            you = " (you)" if entry_id == user_id else ""
+            lines.append(f"{position}. User ...{entry_id[-4:]}: {fmt(score)}{you}")
+        return "\n".join(lines) or "No entries yet."
+
+    message = (
+        "👥 Top Referrers:\n"
+        f"{board_lines(leaderboards['referrals'], lambda score: f'{score:,} referrals')}\n\n"
+        "💰 Top Earners:\n"
+        f"{board_lines(leaderboards['total_earned'], lambda score: f'₦{score:,.2f}')}"
+    )
+    referral_rank = leaderboards["referrals"].rank(user_id)
+    if referral_rank:
+        message += f"\n\n📊 Your referral rank: #{referral_rank:,} of {len(leaderboards['referrals']):,}"
+
+    await update.message.reply_text(
+        message,
+        reply_markup=get_main_menu_keyboard()
+    )
+
+# --- Withdrawal Console ---
+async def process_withdrawals(withdrawal_ids, status):
+    """Move pending withdrawals to ``status`` in one storage write, refund the
+    rejected ones and queue the user notices. Returns how many changed."""
+    changed = await asyncio.to_thread(
+        set_withdrawal_status, withdrawal_ids, status, processed_at=datetime.utcnow().isoformat()
+    )
+    if status == "rejected":
+        refunds = Counter()
+        for _, w in changed:
+            refunds[str(w["user_id"])] += w["amount"]
+        # Undo what handle_withdrawal_amount did to the balance
+        async with user_locks.hold(*refunds):
+            await user_store.prefetch(*refunds)
+            for user_id, amount in refunds.items():
+                user_data = get_user(user_id)
+                user_data["points"] = user_data.get("points", 0) + amount / POINTS_TO_NAIRA
+                user_data["total_withdrawn"] = max(0, user_data.get("total_withdrawn", 0) - amount)
+                user_data["total_earned"] = max(0, user_data.get("total_earned", 0) - amount)
+                update_user(user_id, user_data)
+            await user_store.flush_users(refunds)
+    for _, w in changed:
+        withdrawal_notifier.notify(w)
+    return len(changed)
+
+def render_pending_page(page, selected):
+    """Text and inline keyboard for one page of /pending. Runs in a worker thread."""
+    total = count_pending_withdrawals()
+    pages = max(1, -(-total // PENDING_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    items = pending_withdrawals(page * PENDING_PAGE_SIZE, PENDING_PAGE_SIZE)
+    if not items:
+        return "✅ No pending withdrawals.", None
+
+    lines = [f"🏦 Pending withdrawals: {total} (page {page + 1}/{pages})"]
+    keyboard = []
+    for number, (withdrawal_id, w) in enumerate(items, start=page * PENDING_PAGE_SIZE + 1):
+        details = w.get("account_details") or {}
+        is_selected = withdrawal_id in selected
+        lines.append(
+            f"\n{'☑️' if is_selected else f'{number}.'} ₦{w['amount']:,.2f} · user {w['user_id']} · {w['date'][:16]}\n"
+            f"{details.get('bank')} {details.get('account_number')} {details.get('account_name')}"
+        )
+        keyboard.append([
+            InlineKeyboardButton(f"✅ {number}", callback_data=f"wd:approve:{withdrawal_id}:{page}"),
+            InlineKeyboardButton(f"❌ {number}", callback_data=f"wd:reject:{withdrawal_id}:{page}"),
+            InlineKeyboardButton(f"{'☑️' if is_selected else '⬜'} {number}", callback_data=f"wd:select:{withdrawal_id}:{page}"),
+        ])
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"wd:page::{page - 1}"))
+    navigation.append(InlineKeyboardButton("Select page", callback_data=f"wd:select_page::{page}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"wd:page::{page + 1}"))
+    keyboard.append(navigation)
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Approve {len(selected)}", callback_data=f"wd:approve_selected::{page}"),
+            InlineKeyboardButton(f"❌ Reject {len(selected)}", callback_data=f"wd:reject_selected::{page}"),
+            InlineKeyboardButton("Clear", callback_data=f"wd:clear::{page}"),
+        ])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/pending [page]"""
+    if not is_admin(update):
+        return
+    page = int(context.args[0]) - 1 if context.args and context.args[0].isdigit() else 0
+    selected = frozenset(context.user_data.get("withdrawal_selection", ()))
+    text, markup = await asyncio.to_thread(render_pending_page, page, selected)
+    await update.message.reply_text(text, reply_markup=markup)
+
+async def withdrawal_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not is_admin(update):
+        await query.answer()
+        return
+
+    _, action, withdrawal_id, page = query.data.split(":")
+    page = int(page)
+    selected = context.user_data.setdefault("withdrawal_selection", set())
+    note = None
+
+    if action == "select":
+        selected ^= {withdrawal_id}
+    elif action == "select_page":
+        items = await asyncio.to_thread(pending_withdrawals, page * PENDING_PAGE_SIZE, PENDING_PAGE_SIZE)
+        selected.update(item_id for item_id, _ in items)
+    elif action == "clear":
+        selected.clear()
+    elif action in ("approve", "reject", "approve_selected", "reject_selected"):
+        status = "approved" if action.startswith("approve") else "rejected"
+        ids = [withdrawal_id] if withdrawal_id else list(selected)
+        count = await process_withdrawals(ids, status)
+        selected.difference_update(ids)
+        note = f"{count} withdrawal(s) {status}" if count else "Already processed"
+
+    await query.answer(note)
+    text, markup = await asyncio.to_thread(render_pending_page, page, frozenset(selected))
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except BadRequest:
+        pass  # Nothing changed on the page
+
+EXPORT_COLUMNS = ["bank", "account_number", "account_name", "amount", "user_id", "status", "date", "withdrawal_id"]
+
+def write_export(f, rows, fmt):
+    """Write export rows to the open text file ``f``; returns (count, total amount)."""
+    count, total = 0, 0.0
+    writer = csv.writer(f) if fmt == "csv" else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS)
+    for withdrawal_id, w in rows:
+        details = w.get("account_details") or {}
+        if writer:
+            writer.writerow([
+                details.get("bank"), details.get("account_number"), details.get("account_name"),
+                w["amount"], w["user_id"], w.get("status", "pending"), w["date"], withdrawal_id,
+            ])
+        else:
+            f.write(json.dumps({"withdrawal_id": withdrawal_id, **w}) + "\n")
+        count += 1
+        total += w["amount"]
+    return count, total
+
+def build_export(fmt, status, start, end):
+    """Stream matching withdrawals into a temp file. Runs in a worker thread."""
+    with tempfile.NamedTemporaryFile("w", suffix=f".{fmt}", newline="", delete=False) as f:
+        count, total = write_export(f, export_withdrawals(status, start, end), fmt)
+    return f.name, count, total
+
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [csv|jsonl] [status=pending|approved|rejected|all] [from=YYYY-MM-DD] [to=YYYY-MM-DD]"""
+    if not is_admin(update):
+        return
+
+    fmt, status, start, end = "csv", "pending", None, None
+    try:
+        for arg in context.args or []:
+            key, _, value = arg.lower().partition("=")
+            if key in ("csv", "jsonl") and not value:
+                fmt = key
+            elif key == "status" and value:
+                status = None if value == "all" else value
+            elif key == "from":
+                start = datetime.strptime(value, "%Y-%m-%d").date().isoformat()
+            elif key == "to":
+                end = (datetime.strptime(value, "%Y-%m-%d").date() + timedelta(days=1)).isoformat()
+            else:
+                raise ValueError(arg)
+    except ValueError:
+        await update.message.reply_text(
+            "Usage: /export [csv|jsonl] [status=pending|approved|rejected|all] [from=YYYY-MM-DD] [to=YYYY-MM-DD]"
+        )
+        return
+
+    path, count, total = await asyncio.to_thread(build_export, fmt, status, start, end)
+    try:
+        if not count:
+            await update.message.reply_text("No withdrawals match that export.")
+            return
+        filename = f"withdrawals_{status or 'all'}_{datetime.utcnow():%Y%m%d_%H%M}.{fmt}"
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                document=f, filename=filename,
+                caption=f"📤 {count} withdrawals, ₦{total:,.2f} in total (grouped by bank)"
+            )
+    except TelegramError as e:
+        logger.error(f"Error sending withdrawal export: {e}")
+        await update.message.reply_text(f"❌ Could not send the export: {e}")
+    finally:
+        os.remove(path)
+
+# --- Broadcast ---
+class Broadcast:
+    """One /broadcast run. Progress is checkpointed to BROADCAST_CHECKPOINT
+    after every page so an interrupted run can be resumed."""
+
+    def __init__(self, text, min_level=1, include_unverified=False, admin_chat_id=None,
+                 after=None, delivered=0, blocked=0, failed=0, done=False):
+        self.text = text
+        self.min_level = min_level
+        self.include_unverified = include_unverified
+        self.admin_chat_id = admin_chat_id
+        self.after = after
+        self.delivered = delivered
+        self.blocked = blocked
+        self.failed = failed
+        self.done = done
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def load_checkpoint(cls):
+        try:
+            if os.path.exists(BROADCAST_CHECKPOINT):
+                with open(BROADCAST_CHECKPOINT, "r") as f:
+                    return cls(**json.load(f))
+        except Exception as e:
+            logger.error(f"Error loading broadcast checkpoint: {e}")
+        return None
+
+    def save_checkpoint(self):
+        tmp_path = BROADCAST_CHECKPOINT + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, BROADCAST_CHECKPOINT)
+
+    def matches(self, user_info):
+        if not self.include_unverified and not user_info.get("verified_user"):
+            return False
+        return self.min_level <= 1 or level_engine.level_of(user_info) >= self.min_level
+
+    def summary(self):
+        return (
+            f"Delivered: {self.delivered}\n"
+            f"Blocked: {self.blocked}\n"
+            f"Failed: {self.failed}"
+        )
+
+    async def _send(self, bot, semaphore, user_id):
+        async with semaphore:
+            try:
+                await bot.send_message(chat_id=int(user_id), text=self.text, rate_limit_args=Priority.BROADCAST)
+                self.delivered += 1
+            except Forbidden:
+                self.blocked += 1
+            except TelegramError as e:
+                logger.info(f"Broadcast to {user_id} failed: {e}")
+                self.failed += 1
+
+    async def run(self, bot):
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        async for page in user_store.iter_pages(self.after, BROADCAST_PAGE_SIZE):
+            recipients = [user_id for user_id, user_info in page if self.matches(user_info)]
+            await asyncio.gather(*(self._send(bot, semaphore, user_id) for user_id in recipients))
+            self.after = page[-1][0]
+            await asyncio.to_thread(self.save_checkpoint)
+        self.done = True
+        await asyncio.to_thread(self.save_checkpoint)
+
+current_broadcast = None
+
+async def run_broadcast(bot, job):
+    global current_broadcast
+    current_broadcast = job
+    try:
+        await job.run(bot)
+        text = f"📣 Broadcast finished\n\n{job.summary()}"
+    except Exception as e:
+        logger.error(f"Broadcast stopped: {e}")
+        text = f"❌ Broadcast stopped: {e}\n\n{job.summary()}\n\nUse /broadcast resume to continue."
+    finally:
+        current_broadcast = None
+    await bot.send_message(chat_id=job.admin_chat_id, text=text, rate_limit_args=Priority.ADMIN)
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast [all] [level=N] <message> | /broadcast resume | /broadcast status"""
+    if not is_admin(update):
+        return
+
+    parts = update.message.text.split(None, 1)
+    body = parts[1] if len(parts) > 1 else ""
+    command = body.strip().lower()
+
+    if command == "status":
+        job = current_broadcast
+        if job is None:
+            await update.message.reply_text("No broadcast is running.")
+        else:
+            await update.message.reply_text(f"📣 Broadcast in progress\n\n{job.summary()}")
+        return
+
+    if current_broadcast is not None:
+        await update.message.reply_text("❌ A broadcast is already running. Check it with /broadcast status")
+        return
+
+    if command == "resume":
+        job = Broadcast.load_checkpoint()
+        if job is None or job.done:
+            await update.message.reply_text("There is no unfinished broadcast to resume.")
+            return
+        job.admin_chat_id = update.effective_chat.id
+        await update.message.reply_text(f"📣 Resuming broadcast\n\n{job.summary()}")
+        context.application.create_task(run_broadcast(context.bot, job))
+        return
+
+    # Leading options, then the message itself (newlines preserved)
+    job = Broadcast("", admin_chat_id=update.effective_chat.id)
+    while True:
+        head, _, rest = body.lstrip(" ").partition(" ")
+        if head.lower() == "all":
+            job.include_unverified = True
+        elif head.lower().startswith("level=") and head[6:].isdigit():
+            job.min_level = int(head[6:])
+        else:
+            break
+        body = rest
+    job.text = body.strip()
+
+    if not job.text:
+        await update.message.reply_text(
+            "Usage:\n"
+            "/broadcast [all] [level=N] <message>\n"
+            "/broadcast resume\n"
+            "/broadcast status\n\n"
+            "By default only verified users receive the message."
+        )
+        return
+
+    await asyncio.to_thread(job.save_checkpoint)
+    await update.message.reply_text("📣 Broadcast started. You'll get a report when it finishes.")
+    context.application.create_task(run_broadcast(context.bot, job))
+
+# --- Admin ---
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+
+    lookups = membership_cache.hits + membership_cache.misses
+    hit_rate = membership_cache.hits / lookups * 100 if lookups else 0
+    levels = ", ".join(
+        f"{name} {level_engine.distribution[level_num]}" for name, level_num, _, _ in level_engine.tiers
+    )
+    await update.message.reply_text(
+        f"📊 Bot Stats\n\n"
+        f"Membership cache: {len(membership_cache)} entries\n"
+        f"Hits: {membership_cache.hits} | Misses: {membership_cache.misses} ({hit_rate:.1f}% hit rate)\n"
+        f"Active user locks: {len(user_locks)}\n"
+        f"Queued admin alerts: {len(admin_notifier)}\n"
+        f"Proofs: {len(proof_pipeline)} queued, {proof_pipeline.stored} stored, {proof_pipeline.failed} failed, "
+        f"{proof_pipeline.duplicates} possible duplicates\n\n"
+        f"Levels: {levels}\n"
+        f"Claimed today: daily bonus {claims.count('daily_bonus')}, daily tasks {claims.count('daily_tasks')}\n\n"
+        f"Outbound queue: {outbound.queue_depth} waiting\n"
+        f"Sent: {outbound.sent} | Retried: {outbound.retries}\n"
+        f"Wait: avg {outbound.wait_avg * 1000:.0f} ms, max {outbound.wait_max * 1000:.0f} ms"
+    )
+
+class RuntimeCollector:
+    """Exposes the bot's in-process counters and queue sizes to Prometheus."""
+
+    def collect(self):
+        yield CounterMetricFamily("bot_membership_cache_hits", "Membership cache hits", value=membership_cache.hits)
+        yield CounterMetricFamily("bot_membership_cache_misses", "Membership cache misses", value=membership_cache.misses)
+        yield GaugeMetricFamily("bot_membership_cache_entries", "Membership cache size", value=len(membership_cache))
+        yield GaugeMetricFamily("bot_user_locks", "Per-user locks held or waited on", value=len(user_locks))
+        yield GaugeMetricFamily("bot_admin_alerts_queued", "Admin alerts waiting for the next digest", value=len(admin_notifier))
+        yield GaugeMetricFamily("bot_proofs_queued", "Task proofs waiting to be downloaded", value=len(proof_pipeline))
+        yield CounterMetricFamily("bot_proofs_stored", "Task proofs downloaded and stored", value=proof_pipeline.stored)
+        yield CounterMetricFamily("bot_proofs_failed", "Task proofs that could not be downloaded", value=proof_pipeline.failed)
+        yield CounterMetricFamily("bot_proofs_duplicate", "Task proofs flagged as near-duplicates", value=proof_pipeline.duplicates)
+        yield GaugeMetricFamily("bot_outbound_queue_depth", "Outbound requests waiting in the scheduler", value=outbound.queue_depth)
+        yield CounterMetricFamily("bot_outbound_sent", "Outbound requests released by the scheduler", value=outbound.sent)
+        yield CounterMetricFamily("bot_outbound_retries", "Outbound requests retried after RetryAfter", value=outbound.retries)
+
+        levels = GaugeMetricFamily("bot_users_by_level", "Users per level", labels=["level"])
+        for name, level_num, _, _ in level_engine.tiers:
+            levels.add_metric([name], level_engine.distribution[level_num])
+        yield levels
+
+        claimed = GaugeMetricFamily("bot_claims_today", "Claims made today", labels=["claim"])
+        for field in CLAIM_FIELDS:
+            claimed.add_metric([field], claims.count(field))
+        yield claimed
+
+REGISTRY.register(RuntimeCollector())
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [on|off|sample <rate>|threshold <seconds>]"""
+    if not is_admin(update):
+        return
+
+    args = [arg.lower() for arg in context.args or []]
+    try:
+        if args == ["on"]:
+            profiler.enable()
+        elif args == ["off"]:
+            profiler.disable()
+        elif len(args) == 2 and args[0] == "sample" and 0 <= float(args[1]) <= 1:
+            profiler.sample_rate = float(args[1])
+        elif len(args) == 2 and args[0] == "threshold" and float(args[1]) >= 0:
+            profiler.threshold = float(args[1])
+        elif args:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(
+            "Usage: /profile [on|off|sample <0-1>|threshold <seconds>]\n"
+            "A threshold of 0 disables the slow-update log."
+        )
+        return
+
+    await update.message.reply_text(f"🔬 {profiler.summary()}")
+
+# --- Webhook Server ---
+def create_webhook_server(app, loop):
+    """Flask app that hands Telegram updates to ``app.update_queue``."""
+    server = Flask(__name__)
+
+    @server.post(WEBHOOK_PATH)
+    def telegram_webhook():
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            abort(403)
+        # Updates not yet fetched plus those the processor holds: PTB moves
+        # queued updates into tasks straight away, so qsize() alone stays near 0
+        if app.update_queue.qsize() + len(app.update_processor) >= WEBHOOK_MAX_PENDING:
+            # Any non-2xx makes Telegram redeliver the update later
+            return "", 503
+        update = Update.de_json(request.get_json(force=True), app.bot)
+        loop.call_soon_threadsafe(app.update_queue.put_nowait, update)
+        return "", 200
+
+    @server.get("/health")
+    def health():
+        return "ok", 200
+
+    return server
+
+async def run_webhook(app):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = make_server("0.0.0.0", PORT, create_webhook_server(app, loop), threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, name="webhook", daemon=True)
+
+    async with app:
+        # post_init/post_stop/post_shutdown only fire under run_polling, so call them here
+        await on_startup(app)
+        await app.start()
+        server_thread.start()
+        await app.bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"Webhook server listening on port {PORT}")
+        try:
+            await stop.wait()
+        finally:
+            server.shutdown()
+            await app.stop()
+            await on_stop(app)
+            await on_shutdown(app)
+
+# --- Run Bot ---
+async def on_startup(app):
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    profiler.start()
+    user_store.start()
+    await build_indexes()
+    level_engine.add_listener(
+        lambda user_id, old_level, new_level: app.create_task(announce_level_change(app.bot, user_id, old_level, new_level))
+    )
+    admin_notifier.start(app.bot)
+    withdrawal_notifier.start(app.bot)
+    await asyncio.to_thread(proof_pipeline.hashes.load)
+    proof_pipeline.start(app.bot)
+
+    job = Broadcast.load_checkpoint()
+    if job is not None and not job.done:
+        admin_notifier.notify(f"📣 A broadcast was interrupted.\n\n{job.summary()}\n\nUse /broadcast resume to continue.")
+
+async def on_stop(app):
+    # Runs while the bot can still make requests, unlike on_shutdown
+    await proof_pipeline.stop()
+    await withdrawal_notifier.stop()
+    await admin_notifier.stop()
+    profiler.stop()
+
+async def on_shutdown(app):
+    await user_store.stop()
+
+def main():
+    storage.open()
+    user_store.load()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .rate_limiter(outbound)
+        .build()
+    )
+
+    # Command handlers
+    app.add_handler(CommandHandler("start", instrumented(serialized(start, referrer_lock_keys))))
+    app.add_handler(CommandHandler("top", instrumented(serialized(top))))
+    app.add_handler(CommandHandler("stats", instrumented(stats)))
+    app.add_handler(CommandHandler("broadcast", instrumented(broadcast)))
+    app.add_handler(CommandHandler("profile", instrumented(profile)))
+    app.add_handler(CommandHandler("pending", instrumented(pending)))
+    app.add_handler(CommandHandler("export", instrumented(export)))
+    
+    # Callback query handlers
+    app.add_handler(CallbackQueryHandler(instrumented(serialized(confirm_twitter)), pattern="^confirm_twitter$"))
+    app.add_handler(CallbackQueryHandler(instrumented(serialized(verify_tasks)), pattern="^verify_tasks$"))
+    # Not serialized: it locks the users it refunds, and the admin may be one of them
+    app.add_handler(CallbackQueryHandler(instrumented(withdrawal_action), pattern="^wd:"))
+    
+    # Message handlers
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(serialized(handle_text_message))))
+    app.add_handler(MessageHandler(filters.PHOTO, instrumented(serialized(handle_task_proof))))
+
+    # Error handler
+    app.add_error_handler(error_handler)
+    
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            logger.error("BOT_MODE=webhook needs WEBHOOK_URL to be set")
+            return
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
+    if user_store.load_error is not None:
+        sys.exit(f"Loading user data failed: {user_store.load_error}")
+
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.error(f"Update {update} caused error {context.error}")
+    
+    if update and update.effective_user:
+        await context.bot.send_message(
+            chat_id=update.effective_user.id,
+            text="❌ An error occurred but it's fine.\n\nContinue with the menu below...",
+            reply_markup=get_main_menu_keyboard()
+        )
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["import-json"]:
+        import_json_to_sqlite()
+    elif sys.argv[1:2] == ["reshard"]:
+        if len(sys.argv) != 3 or not sys.argv[2].isdigit() or int(sys.argv[2]) < 1:
+            sys.exit("Usage: python bot.py reshard <number of shards>")
+        reshard(int(sys.argv[2]))
+    else:
+        main()
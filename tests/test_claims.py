@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+
+import bot
+
+def at(monkeypatch, moment):
+    monkeypatch.setattr(bot.time, "time", lambda: datetime.fromisoformat(moment).replace(tzinfo=timezone.utc).timestamp())
+
+def test_claims_roll_over_at_the_day_boundary(monkeypatch):
+    claims = bot.ClaimIndex(boundary_hour=4, retention_days=3)
+    at(monkeypatch, "2024-01-10T03:59:00")
+    # Before the boundary hour it's still the previous day
+    assert claims.today() == "2024-01-09"
+    claims.mark("daily_bonus", 1)
+    assert claims.has_claimed("daily_bonus", 1)
+    assert not claims.has_claimed("daily_tasks", 1)
+
+    at(monkeypatch, "2024-01-10T04:00:00")
+    assert claims.today() == "2024-01-10"
+    assert not claims.has_claimed("daily_bonus", 1)
+    assert claims.count("daily_bonus", "2024-01-09") == 1
+
+def test_claims_older_than_retention_are_dropped(monkeypatch):
+    claims = bot.ClaimIndex(boundary_hour=0, retention_days=3)
+    at(monkeypatch, "2024-01-10T12:00:00")
+    for user_id, day in enumerate(["2024-01-06", "2024-01-08", "2024-01-09", "2024-01-10"]):
+        claims.index(user_id, {"daily_bonus": {"date": day}, "daily_tasks": None})
+    # 01-06 was already outside the window when it was indexed
+    assert [claims.count("daily_bonus", day) for day in ("2024-01-06", "2024-01-08", "2024-01-09", "2024-01-10")] == [0, 1, 1, 1]
+
+    at(monkeypatch, "2024-01-12T00:00:00")
+    assert claims.today() == "2024-01-12"
+    assert claims.count("daily_bonus", "2024-01-08") == 0
+    assert claims.count("daily_bonus", "2024-01-09") == 0
+    assert claims.count("daily_bonus", "2024-01-10") == 1
+    claims.mark("daily_bonus", 9, "2024-01-09")
+    assert claims.count("daily_bonus", "2024-01-09") == 0
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+import bot
+
+USERS = {
+    "1001": {"points": 10, "account_name": "Ada {Eze}", "bank_name": "Op\"ay\": }, {"},
+    "1002": {"points": 2.5, "daily_bonus": {"date": "2024-05-01"}, "referral": "1001"},
+    "1003": {"account_name": "Ngozi Ọkafọr 💸", "nested": {"a": [1, {"b": "}"}]}},
+    "1004": {"points": 1234567890},
+    "1005": {},
+}
+
+def read_all(path, chunk_size):
+    return {key: info for key, info, _ in bot.iter_data(str(path), chunk_size)}
+
+@pytest.mark.parametrize("indent", [None, 4])
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_matches_json_load_across_chunk_boundaries(tmp_path, indent, chunk_size):
+    path = tmp_path / "user_data.json"
+    path.write_text(json.dumps(USERS, indent=indent, ensure_ascii=False), encoding="utf-8")
+    assert read_all(path, chunk_size) == USERS
+
+def test_reads_data_writer_output(tmp_path):
+    path = str(tmp_path / "user_data.json")
+    bot.write_data(path, USERS.items())
+    assert read_all(path, 5) == USERS
+    assert json.load(open(path)) == USERS
+
+def test_reports_bytes_read(tmp_path):
+    path = tmp_path / "user_data.json"
+    path.write_text(json.dumps(USERS))
+    reads = [read for _, _, read in bot.iter_data(str(path), 16)]
+    assert reads == sorted(reads)
+    assert reads[-1] == path.stat().st_size
+
+@pytest.mark.parametrize("text", ["", "  \n", "{}", "{\n}\n"])
+def test_empty_file_has_no_users(tmp_path, text):
+    path = tmp_path / "user_data.json"
+    path.write_text(text)
+    assert read_all(path, 1) == {}
+
+@pytest.mark.parametrize("text", ['{"1": {"points": 1}', '{"1": {"poi', "[]", '{"1" {}}'])
+def test_truncated_or_invalid_file_raises(tmp_path, text):
+    path = tmp_path / "user_data.json"
+    path.write_text(text)
+    with pytest.raises(ValueError):
+        read_all(path, 3)
+
+def test_find_data_ignores_keys_inside_strings(tmp_path):
+    path = str(tmp_path / "user_data.json")
+    bot.write_data(path, {"1": {"account_name": '"2": {"points": 99}'}, "2": {"points": 2}}.items())
+    assert bot.find_data("2", path) == {"points": 2}
+    assert bot.find_data("3", path) is None
@@ -0,0 +1,37 @@
+import bot
+
+def make_journal(tmp_path):
+    return bot.UserJournal(str(tmp_path / "user_data.journal"), str(tmp_path / "user_data.json"))
+
+def test_replay_returns_newest_record_per_user(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.open()
+    journal.append({"1": {"points": 1}, "2": {"points": 2}})
+    journal.append({"1": {"points": 10}})
+    journal.close()
+    assert make_journal(tmp_path).replay() == {"1": {"points": 10}, "2": {"points": 2}}
+
+def test_append_after_torn_tail_is_replayed(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.open()
+    journal.append({"1": {"points": 1}, "2": {"points": 2}})
+    journal.close()
+    # A crash in the middle of writing the next flush
+    with open(journal._path(1), "ab") as f:
+        f.write(b'{"id": "3", "record": {"poi')
+
+    journal = make_journal(tmp_path)
+    assert journal.replay() == {"1": {"points": 1}, "2": {"points": 2}}
+    journal.open()
+    journal.append({"3": {"points": 3}})
+    journal.close()
+    assert make_journal(tmp_path).replay() == {"1": {"points": 1}, "2": {"points": 2}, "3": {"points": 3}}
+
+def test_torn_tail_without_any_complete_line(tmp_path):
+    journal = make_journal(tmp_path)
+    with open(journal._path(1), "wb") as f:
+        f.write(b'{"id": "1", "rec')
+    journal.open()
+    journal.append({"1": {"points": 1}})
+    journal.close()
+    assert make_journal(tmp_path).replay() == {"1": {"points": 1}}
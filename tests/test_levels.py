@@ -0,0 +1,23 @@
+import bot
+
+OLD_TIERS = [["Bronze", 1, 0, 0], ["Silver", 2, 5, 1000]]
+NEW_TIERS = [["Bronze", 1, 0, 0], ["Silver", 2, 2, 500]]
+
+def test_cached_level_is_reevaluated_when_tiers_change():
+    old_engine = bot.LevelEngine(OLD_TIERS)
+    user_info = {"referrals": 3, "total_earned": 600}
+    old_engine.on_user_update("1", None, user_info)
+    assert user_info["level"] == 1
+
+    # Restarted with new tiers: the distribution is seeded from fresh evaluations
+    engine = bot.LevelEngine(NEW_TIERS)
+    engine.count([user_info])
+    assert engine.level_of(user_info) == 2
+
+    for points in (10, 20):
+        new_info = dict(user_info, points=points)
+        engine.on_user_update("1", user_info, new_info)
+        user_info = new_info
+    assert user_info["level"] == 2
+    assert +engine.distribution == {2: 1}
+    assert engine.distribution[1] == 0
@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+import bot
+
+class MembershipBot:
+    def __init__(self, members, delay=0.01):
+        self.members = members
+        self.delay = delay
+        self.calls = []
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls.append(user_id)
+        await asyncio.sleep(self.delay)
+        if user_id not in self.members:
+            raise BadRequest("User not found")
+        return SimpleNamespace(status=self.members[user_id])
+
+def test_concurrent_lookups_share_one_request():
+    checker = MembershipBot({1: "member", 2: "left"})
+    cache = bot.MembershipCache(ttl=60, negative_ttl=60)
+
+    async def go():
+        return await asyncio.gather(*(cache.is_member(checker, user_id) for user_id in (1, 1, 1, 2, 2, 3)))
+
+    assert asyncio.run(go()) == [True, True, True, False, False, False]
+    assert sorted(checker.calls) == [1, 2, 3]
+    assert cache.misses == 6 and cache.hits == 0
+
+def test_cancelled_caller_does_not_cancel_the_shared_request():
+    checker = MembershipBot({1: "member"}, delay=0.05)
+    cache = bot.MembershipCache(ttl=60, negative_ttl=60)
+
+    async def go():
+        impatient = asyncio.create_task(cache.is_member(checker, 1))
+        patient = asyncio.create_task(cache.is_member(checker, 1))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return await patient
+
+    assert asyncio.run(go()) is True
+    assert checker.calls == [1]
+
+def test_positive_and_negative_results_expire_separately():
+    checker = MembershipBot({1: "member", 2: "left"}, delay=0)
+    cache = bot.MembershipCache(ttl=0.3, negative_ttl=0.05)
+
+    async def go():
+        await cache.is_member(checker, 1)
+        await cache.is_member(checker, 2)
+        await asyncio.sleep(0.1)
+        # The negative result has expired, the positive one hasn't
+        assert await cache.is_member(checker, 1) is True
+        checker.members[2] = "member"
+        assert await cache.is_member(checker, 2) is True
+        await asyncio.sleep(0.3)
+        await cache.is_member(checker, 1)
+
+    asyncio.run(go())
+    assert checker.calls == [1, 2, 2, 1]
+    assert cache.hits == 1
@@ -0,0 +1,62 @@
+import asyncio
+
+import bot
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+def test_admin_alerts_in_digest_window_are_sent_on_stop(monkeypatch):
+    monkeypatch.setattr(bot, "ADMIN_CHAT_ID", "42")
+    recorder = RecordingBot()
+
+    async def go():
+        notifier = bot.AdminNotifier(max_items=20, interval=60, max_retries=1)
+        notifier.start(recorder)
+        notifier.notify("first")
+        notifier.notify("second")
+        await asyncio.sleep(0.01)  # The worker now holds both, waiting out the window
+        notifier.notify("third")
+        await asyncio.wait_for(notifier.stop(), 1)
+
+    asyncio.run(go())
+    assert len(recorder.sent) == 1
+    chat_id, text = recorder.sent[0]
+    assert chat_id == "42"
+    assert "3 new alerts" in text and all(word in text for word in ("first", "second", "third"))
+
+def test_admin_alerts_past_max_items_are_sent_on_stop(monkeypatch):
+    monkeypatch.setattr(bot, "ADMIN_CHAT_ID", "42")
+    recorder = RecordingBot()
+
+    async def go():
+        notifier = bot.AdminNotifier(max_items=2, interval=60, max_retries=1)
+        for i in range(5):
+            notifier.notify(f"alert {i}")
+        notifier.start(recorder)
+        await asyncio.wait_for(notifier.stop(), 1)
+
+    asyncio.run(go())
+    text = "\n".join(text for _, text in recorder.sent)
+    assert all(f"alert {i}" in text for i in range(5))
+
+def test_withdrawal_notices_in_digest_window_are_sent_on_stop():
+    recorder = RecordingBot()
+
+    async def go():
+        notifier = bot.WithdrawalNotifier(interval=60, max_retries=1)
+        notifier.start(recorder)
+        notifier.notify({"user_id": "1", "amount": 1000.0, "status": "approved"})
+        notifier.notify({"user_id": "2", "amount": 2000.0, "status": "rejected"})
+        await asyncio.sleep(0.01)
+        notifier.notify({"user_id": "1", "amount": 500.0, "status": "rejected"})
+        await asyncio.wait_for(notifier.stop(), 1)
+
+    asyncio.run(go())
+    sent = dict(recorder.sent)
+    assert set(sent) == {"1", "2"}
+    assert "1,000.00" in sent["1"] and "500.00" in sent["1"]
+    assert "rejected" in sent["2"]
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+import bot
+
+class RecordingEndpoint:
+    """A Bot API call that records when each chat's request went out."""
+
+    def __init__(self, fail_first=0, retry_after=0.05):
+        self.sent = []
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+        self.started = time.monotonic()
+
+    def send(self, scheduler, chat_id, priority=None):
+        async def callback():
+            if self.fail_first:
+                self.fail_first -= 1
+                raise RetryAfter(self.retry_after)
+            self.sent.append((chat_id, time.monotonic() - self.started))
+        return scheduler.process_request(callback, (), {}, "sendMessage", {"chat_id": chat_id}, priority)
+
+def test_chat_over_its_burst_is_parked_without_holding_up_others():
+    scheduler = bot.OutboundScheduler(global_rate=1000, chat_rate=10, chat_burst=3, max_retries=0)
+    endpoint = RecordingEndpoint()
+
+    async def go():
+        await scheduler.initialize()
+        sends = [endpoint.send(scheduler, 1) for _ in range(5)] + [endpoint.send(scheduler, 2)]
+        await asyncio.wait_for(asyncio.gather(*sends), 2)
+        await scheduler.shutdown()
+
+    asyncio.run(go())
+    chats = [chat_id for chat_id, _ in endpoint.sent]
+    # The burst goes out at once, then chat 2 overtakes chat 1's parked requests
+    assert chats == [1, 1, 1, 2, 1, 1]
+    times = [at for _, at in endpoint.sent]
+    assert times[3] < 0.05
+    assert 0.08 <= times[4] and 0.18 <= times[5]
+    assert scheduler.queue_depth == 0
+    assert scheduler.sent == 6
+
+def test_queued_requests_go_out_in_priority_order():
+    scheduler = bot.OutboundScheduler(global_rate=1000, max_retries=0)
+    endpoint = RecordingEndpoint()
+
+    async def go():
+        priorities = [bot.Priority.BROADCAST, bot.Priority.ADMIN, bot.Priority.BROADCAST, None, bot.Priority.ADMIN]
+        sends = [
+            asyncio.create_task(endpoint.send(scheduler, chat_id, priority))
+            for chat_id, priority in enumerate(priorities, start=1)
+        ]
+        await asyncio.sleep(0)  # Everything is queued before the dispatcher starts
+        assert scheduler.queue_depth == len(priorities)
+        await scheduler.initialize()
+        await asyncio.wait_for(asyncio.gather(*sends), 1)
+        await scheduler.shutdown()
+
+    asyncio.run(go())
+    # Replies (no rate_limit_args) first, then admin alerts, then broadcasts, FIFO within each
+    assert [chat_id for chat_id, _ in endpoint.sent] == [4, 2, 5, 1, 3]
+
+def test_retry_after_pauses_the_chat_and_requeues_the_request():
+    scheduler = bot.OutboundScheduler(global_rate=1000, chat_rate=1000, chat_burst=10, max_retries=1)
+    endpoint = RecordingEndpoint(fail_first=1, retry_after=0.1)
+
+    async def go():
+        await scheduler.initialize()
+        first = asyncio.create_task(endpoint.send(scheduler, 1))
+        await asyncio.sleep(0.01)  # Chat 1 is now paused
+        await endpoint.send(scheduler, 2)
+        await asyncio.wait_for(first, 1)
+        await scheduler.shutdown()
+
+    asyncio.run(go())
+    assert [chat_id for chat_id, _ in endpoint.sent] == [2, 1]
+    assert dict(endpoint.sent)[1] >= 0.1
+    assert scheduler.retries == 1
@@ -0,0 +1,24 @@
+import threading
+
+import bot
+
+def watchdogs():
+    return [thread for thread in threading.enumerate() if thread.name == "slow-update-watchdog"]
+
+def test_watchdog_only_runs_while_profiling_is_enabled(tmp_path):
+    profiler = bot.UpdateProfiler(enabled=False, log_file=str(tmp_path / "slow.log"))
+    profiler.start()
+    assert watchdogs() == []
+
+    profiler.enable()
+    profiler.enable()
+    assert len(watchdogs()) == 1
+
+    profiler.disable()
+    assert watchdogs() == []
+    assert not profiler.enabled
+
+    profiler.enable()
+    assert len(watchdogs()) == 1
+    profiler.stop()
+    assert watchdogs() == []
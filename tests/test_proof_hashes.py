@@ -0,0 +1,55 @@
+import random
+
+import bot
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+def stored_index(tmp_path, count=500, max_distance=6):
+    rng = random.Random(7)
+    index = bot.ProofHashIndex(str(tmp_path / "proof_hashes.txt"), max_distance=max_distance)
+    hashes = [rng.getrandbits(64) for _ in range(count)]
+    for entry, value in enumerate(hashes):
+        index.match_and_add(value, str(entry), f"p{entry}")
+    return index, hashes
+
+def test_near_duplicates_within_max_distance_are_always_found(tmp_path):
+    index, hashes = stored_index(tmp_path)
+    rng = random.Random(11)
+    for entry, value in enumerate(hashes):
+        # Spread the flipped bits every way, including all into one chunk
+        for distance in range(index.max_distance + 1):
+            bits = rng.sample(range(64), distance) if entry % 2 else range(distance)
+            matches = index.find(flip(value, bits))
+            assert (distance, str(entry), f"p{entry}") in matches
+
+def test_hashes_beyond_max_distance_are_not_found(tmp_path):
+    index, hashes = stored_index(tmp_path)
+    rng = random.Random(13)
+    for _ in range(2000):
+        probe = rng.getrandbits(64)
+        expected = sorted(
+            (distance, str(entry), f"p{entry}")
+            for entry, value in enumerate(hashes)
+            if (distance := (value ^ probe).bit_count()) <= index.max_distance
+        )
+        assert index.find(probe) == expected
+    value = hashes[0]
+    assert all(owner != "0" for _, owner, _ in index.find(flip(value, range(index.max_distance + 1))))
+
+def test_index_survives_a_reload(tmp_path):
+    index, hashes = stored_index(tmp_path)
+    reloaded = bot.ProofHashIndex(index.path, max_distance=index.max_distance)
+    reloaded.load()
+    assert len(reloaded) == len(hashes)
+    for entry, value in enumerate(hashes):
+        near = flip(value, [0, 20, 40])
+        assert reloaded.find(near) == index.find(near)
+        assert (3, str(entry), f"p{entry}") in reloaded.find(near)
+    # New entries go to the same file after the reload
+    assert reloaded.match_and_add(hashes[0], "new", "p-new")[0] == (0, "0", "p0")
+    again = bot.ProofHashIndex(index.path, max_distance=index.max_distance)
+    again.load()
+    assert len(again) == len(hashes) + 1
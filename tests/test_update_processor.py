@@ -0,0 +1,89 @@
+import asyncio
+
+from telegram import Update
+
+import bot
+
+def make_update(update_id, user_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "hi",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+        },
+    }, None)
+
+def test_busy_user_holds_one_slot_and_keeps_order():
+    events = []
+
+    async def go():
+        processor = bot.PerUserUpdateProcessor(2)
+        release = asyncio.Event()
+
+        async def slow(label):
+            events.append(f"start {label}")
+            await release.wait()
+            events.append(f"end {label}")
+
+        async def fast(label):
+            events.append(f"run {label}")
+
+        tasks = [asyncio.create_task(processor.process_update(make_update(i, 1), slow(f"a{i}"))) for i in range(5)]
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(processor.process_update(make_update(10, 2), fast("b")), 1)
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(go())
+    assert events[:2] == ["start a0", "run b"]
+    assert [event for event in events if event.startswith("start")] == [f"start a{i}" for i in range(5)]
+    # User 1's updates never overlapped
+    for i in range(4):
+        assert events.index(f"end a{i}") < events.index(f"start a{i + 1}")
+
+def test_slots_limit_concurrency_across_users():
+    running, peak = 0, 0
+
+    async def go():
+        processor = bot.PerUserUpdateProcessor(3)
+
+        async def work():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(make_update(i, i), work()) for i in range(10)))
+
+    asyncio.run(go())
+    assert peak == 3
+
+class FakeApp:
+    def __init__(self, processor):
+        self.bot = None
+        self.update_queue = asyncio.Queue()
+        self.update_processor = processor
+
+def test_webhook_pushes_back_on_updates_in_flight(monkeypatch):
+    monkeypatch.setattr(bot, "WEBHOOK_MAX_PENDING", 3)
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", None)
+    loop = asyncio.new_event_loop()
+    processor = bot.PerUserUpdateProcessor(2)
+    app = FakeApp(processor)
+    client = bot.create_webhook_server(app, loop).test_client()
+    payload = make_update(1, 1).to_dict()
+
+    release = asyncio.Event()
+    tasks = [loop.create_task(processor.process_update(make_update(i, 1), release.wait())) for i in range(3)]
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert len(processor) == 3 and app.update_queue.qsize() == 0
+    assert client.post(bot.WEBHOOK_PATH, json=payload).status_code == 503
+
+    release.set()
+    loop.run_until_complete(asyncio.gather(*tasks))
+    assert len(processor) == 0
+    assert client.post(bot.WEBHOOK_PATH, json=payload).status_code == 200
+    assert client.get("/metrics").status_code == 404
+    loop.close()
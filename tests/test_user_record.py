@@ -0,0 +1,28 @@
+import copy
+import json
+
+import pytest
+
+import bot
+
+def test_round_trips_through_dict_and_json():
+    data = {"points": 5, "daily_bonus": {"date": "2024-05-01"}, "custom": [1, 2]}
+    record = bot.UserRecord(data)
+    assert dict(record) == data
+    assert json.loads(json.dumps(record, default=dict)) == data
+
+def test_claim_values_are_read_only():
+    record = bot.UserRecord({"daily_bonus": {"date": "2024-05-01"}})
+    with pytest.raises(TypeError):
+        record["daily_bonus"]["date"] = "2024-05-02"
+    with pytest.raises(TypeError):
+        record["daily_bonus"].update(date="2024-05-02")
+    record["daily_bonus"] = {"date": "2024-05-02"}
+    assert record["daily_bonus"] == {"date": "2024-05-02"}
+
+def test_copies_of_claim_values_are_plain_dicts():
+    record = bot.UserRecord({"daily_tasks": {"date": "2024-05-01"}})
+    data = copy.deepcopy(dict(record))
+    data["daily_tasks"]["date"] = "2024-05-03"
+    assert bot.UserRecord.from_mapping(data)["daily_tasks"] == {"date": "2024-05-03"}
+    assert record["daily_tasks"].copy() == {"date": "2024-05-01"}
@@ -0,0 +1,156 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import bot
+
+def test_failed_sqlite_flush_is_retried(tmp_path, monkeypatch):
+    backend = bot.SqliteBackend(str(tmp_path / "bot.db"))
+    store = bot.UserStore(backend)
+
+    async def go():
+        store.load()
+        store.update("1", {"points": 1})
+        broken = sqlite3.connect(":memory:")
+        broken.close()
+        with monkeypatch.context() as patch:
+            patch.setattr(backend, "_conn", lambda: broken)
+            with pytest.raises(sqlite3.Error):
+                await store.flush()
+        assert backend.get_user("1") is None
+        await store.flush()
+
+    asyncio.run(go())
+    assert backend.get_user("1") == {"points": 1}
+
+def test_prefetch_reads_off_the_event_loop_while_streaming(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bot.write_data(bot.DATA_FILE, {"1": {"points": 1}, "2": {"points": 2}}.items())
+    backend = bot.JsonBackend()
+    backend.open()
+    release = threading.Event()
+
+    def stalled_stream():
+        release.wait(5)
+        yield from ()
+    monkeypatch.setattr(backend, "stream_users", stalled_stream)
+
+    lookups = []
+    find_user = backend.find_user
+    def tracked_find_user(key):
+        lookups.append((key, threading.current_thread() is threading.main_thread()))
+        return find_user(key)
+    monkeypatch.setattr(backend, "find_user", tracked_find_user)
+
+    store = bot.UserStore(backend, stream=True)
+
+    async def go():
+        store.load()
+        assert store.loading
+        await store.prefetch(1, 999)
+        assert store.get(1)["points"] == 1
+        assert store.get(999) == {}
+        release.set()
+        await store.wait_loaded()
+
+    asyncio.run(go())
+    backend.close()
+    assert sorted(lookups) == [("1", False), ("999", False)]
+
+def test_prefetch_reads_sqlite_off_the_event_loop(tmp_path, monkeypatch):
+    backend = bot.SqliteBackend(str(tmp_path / "bot.db"))
+    backend.write_users({"1": {"points": 1}})
+    store = bot.UserStore(backend)
+
+    lookups = []
+    get_user = backend.get_user
+    def tracked_get_user(key):
+        lookups.append((key, threading.current_thread() is threading.main_thread()))
+        return get_user(key)
+    monkeypatch.setattr(backend, "get_user", tracked_get_user)
+
+    async def go():
+        await store.prefetch(1, 2)
+        assert store.get(1)["points"] == 1
+        assert store.get(2) == {}
+        store.update(2, {"points": 5})
+        assert store.get(2)["points"] == 5
+        await store.flush()
+
+    asyncio.run(go())
+    assert sorted(lookups) == [("1", False), ("2", False)]
+    assert get_user("2") == {"points": 5}
+
+def test_flush_users_writes_only_their_shards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    backend = bot.JsonBackend(shards=4)
+    backend.open()
+    store = bot.UserStore(backend, stream=False)
+    users = [str(user_id) for user_id in range(100, 140)]
+    target = users[0]
+    others = [user_id for user_id in users if backend.shard_of(user_id) != backend.shard_of(target)]
+
+    async def go():
+        store.load()
+        for user_id in users:
+            store.update(user_id, {"points": int(user_id)})
+        await store.flush_users([int(target)])
+
+    asyncio.run(go())
+    backend.close()
+    written = bot.JsonBackend(shards=4)
+    written.open()
+    assert written.find_user(target) == {"points": int(target)}
+    assert all(written.find_user(user_id) is None for user_id in others)
+
+def test_truncated_user_data_keeps_parsed_records_and_fails_loading(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bot.write_data(bot.DATA_FILE, ((str(user_id), {"points": user_id}) for user_id in range(2500)))
+    with open(bot.DATA_FILE, "rb+") as f:
+        f.truncate(f.seek(0, 2) - 20)
+    backend = bot.JsonBackend()
+    backend.open()
+    store = bot.UserStore(backend, stream=True)
+
+    async def go():
+        store.load()
+        with pytest.raises(RuntimeError):
+            await store.wait_loaded()
+        # Still loading, so nothing can be saved over a user that wasn't read
+        assert store.loading
+        with pytest.raises(RuntimeError):
+            store.get(1)
+
+    asyncio.run(go())
+    backend.close()
+    assert isinstance(store.load_error, ValueError)
+    # The records parsed before the cut are kept, not just whole batches
+    assert store._users["2450"]["points"] == 2450
+
+def test_sqlite_cache_evicts_least_recently_used_clean_records(tmp_path):
+    backend = bot.SqliteBackend(str(tmp_path / "bot.db"))
+    backend.write_users({str(user_id): {"points": user_id} for user_id in range(1, 6)})
+    store = bot.UserStore(backend, cache_size=3)
+
+    async def go():
+        for user_id in (1, 2, 3):
+            await store.prefetch(user_id)
+        store.update(9, {"points": 9})
+        store.get(2)
+        assert list(store._users) == ["3", "9", "2"]
+        await store.prefetch(4)
+        await store.prefetch(5)
+        # 9 is the least recently used, but its change isn't written yet
+        assert list(store._users) == ["4", "5", "9"]
+        await store.flush()
+        for user_id in (1, 2, 3):
+            await store.prefetch(user_id)
+        assert list(store._users) == ["1", "2", "3"]
+        assert store.get(9)["points"] == 9
+
+        await store.prefetch(*range(100, 110))
+        assert len(store._missing) == 3
+
+    asyncio.run(go())
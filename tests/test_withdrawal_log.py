@@ -0,0 +1,56 @@
+import bot
+
+def withdrawal(user_id, date, status="pending"):
+    return {"user_id": user_id, "amount": 1000.0, "status": status, "date": date, "account_details": {}}
+
+def test_append_after_torn_tail_survives_reload(tmp_path):
+    path = str(tmp_path / "withdrawals.jsonl")
+    log = bot.WithdrawalLog(path, legacy_file=None)
+    log.append("w1", withdrawal("1", "2024-01-01T00:00:00"))
+    # A crash in the middle of writing the next record
+    with open(path, "ab") as f:
+        f.write(b'{"id": "w2", "record": {"user_id": "1", "amo')
+
+    log = bot.WithdrawalLog(path, legacy_file=None)
+    log.append("w3", withdrawal("1", "2024-01-03T00:00:00"))
+
+    reloaded = bot.WithdrawalLog(path, legacy_file=None)
+    assert sorted(reloaded.read_all()) == ["w1", "w3"]
+    assert [w["date"] for w in reloaded.for_user("1")] == ["2024-01-03T00:00:00", "2024-01-01T00:00:00"]
+    assert reloaded.pending_count() == 2
+
+def test_status_change_moves_record_out_of_pending(tmp_path):
+    log = bot.WithdrawalLog(str(tmp_path / "withdrawals.jsonl"), legacy_file=None)
+    log.append("w1", withdrawal("1", "2024-01-01T00:00:00"))
+    log.append("w2", withdrawal("2", "2024-01-02T00:00:00"))
+    changed = log.set_status_many(["w1", "missing"], "approved")
+    assert [withdrawal_id for withdrawal_id, _ in changed] == ["w1"]
+    assert [withdrawal_id for withdrawal_id, _ in log.pending_page(0, 10)] == ["w2"]
+    reloaded = bot.WithdrawalLog(log.path, legacy_file=None)
+    assert reloaded.read_all()["w1"]["status"] == "approved"
+    assert reloaded.pending_count() == 1
+
+def test_record_log_reports_metrics_under_its_own_name(tmp_path):
+    log = bot.RecordLog(str(tmp_path / "proofs.jsonl"), "proof")
+    log.append("p1", {"user_id": "1", "date": "2024-01-01T00:00:00", "status": "pending"})
+    assert log.for_user("1")[0]["status"] == "pending"
+    assert not hasattr(log, "set_status_many")
+    ops = {sample.labels["op"] for metric in bot.STORAGE_LATENCY.collect() for sample in metric.samples}
+    assert {"load_proof_index", "append_proof", "user_proofs"} <= ops
+
+def test_export_is_grouped_by_bank_and_ordered_by_date(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    backend = bot.JsonBackend()
+    backend.open()
+    for withdrawal_id, bank, day in (("w1", "Palmpay", 1), ("w2", "Opay", 2), ("w3", "Opay", 3), ("w4", "Palmpay", 4)):
+        record = withdrawal("1", f"2024-01-0{day}T00:00:00")
+        record["account_details"] = {"bank": bank}
+        backend.add_withdrawal(withdrawal_id, record)
+    # Status changes re-append w1 and w2 after the others
+    backend.set_withdrawal_status(["w2", "w1"], "approved")
+
+    exported = [withdrawal_id for withdrawal_id, _ in backend.export_withdrawals()]
+    assert exported == ["w2", "w3", "w1", "w4"]
+    assert [withdrawal_id for withdrawal_id, _ in backend.export_withdrawals(status="pending")] == ["w3", "w4"]
+    assert [withdrawal_id for withdrawal_id, _ in backend.export_withdrawals(start="2024-01-02", end="2024-01-04")] == ["w2", "w3"]
+    backend.close()